@@ -4,28 +4,53 @@ csvwise Web UI - Streamlit Application
 用自然语言分析 CSV 数据和数据库
 """
 
-import io
-import os
+import hashlib
 import sys
-import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 
+import matplotlib
+matplotlib.use("Agg")  # 无界面后端，跳过 GUI 探测
+import matplotlib.pyplot as plt
+import pandas as pd
+import pyarrow as pa  # streamlit 自带依赖
 import streamlit as st
 
+# 更快的内容哈希（可选）
+try:
+    import xxhash
+    HAS_XXHASH = True
+except ImportError:
+    HAS_XXHASH = False
+
 # 添加 src 目录到 path
 src_path = str(Path(__file__).parent / "src")
 if src_path not in sys.path:
     sys.path.insert(0, src_path)
 
-# 直接导入模块避免命名冲突
+# 直接导入模块避免命名冲突；登记到 sys.modules，每次重新运行脚本不再重复执行整个模块
 import importlib.util
-spec = importlib.util.spec_from_file_location("csvwise_mod", Path(__file__).parent / "src" / "csvwise.py")
-csvwise_mod = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(csvwise_mod)
+csvwise_mod = sys.modules.get("csvwise_mod")
+if csvwise_mod is None:
+    spec = importlib.util.spec_from_file_location("csvwise_mod", Path(__file__).parent / "src" / "csvwise.py")
+    csvwise_mod = importlib.util.module_from_spec(spec)
+    sys.modules["csvwise_mod"] = csvwise_mod
+    spec.loader.exec_module(csvwise_mod)
 
 Dataset = csvwise_mod.DataContext  # DataContext 重命名为 Dataset
 load_csv = csvwise_mod.load_csv
 llm_query = csvwise_mod.llm_query
+llm_query_many = csvwise_mod.llm_query_many
+llm_query_stream = csvwise_mod.llm_query_stream
+find_cached_question = csvwise_mod.find_cached_question
+normalize_question = csvwise_mod.normalize_question
+build_batch_question = csvwise_mod.build_batch_question
+split_batch_answers = csvwise_mod.split_batch_answers
+LLM_BATCH_SIZE = csvwise_mod.LLM_BATCH_SIZE
+LLM_MAX_WORKERS = csvwise_mod.LLM_MAX_WORKERS
 csv_to_markdown_table = csvwise_mod.csv_to_markdown_table
 VERSION = csvwise_mod.VERSION
 
@@ -56,6 +81,207 @@ if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 if "db_connector" not in st.session_state:
     st.session_state.db_connector = None
+if "prompt_context" not in st.session_state:
+    st.session_state.prompt_context = None
+if "dataset_key" not in st.session_state:
+    st.session_state.dataset_key = None  # 数据内容标识，派生缓存（DataFrame 等）按它查找
+if "pending_answers" not in st.session_state:
+    st.session_state.pending_answers = []  # 后台回答中的 (问题列表, Future)，每批一项
+if "upload_hash" not in st.session_state:
+    st.session_state.upload_hash = (None, None)  # 上次哈希过的上传文件 (file_id, 内容哈希)
+
+# ---------------------------------------------------------------------------
+# Cached Builders
+# ---------------------------------------------------------------------------
+
+def content_hash(data: bytes) -> str:
+    """上传文件的内容哈希（128 位）：装了 xxhash 用 xxh3，否则用标准库 blake2b"""
+    if HAS_XXHASH:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def build_dataset(file_hash: str, _file_bytes: bytes, suffix: str = ".csv"):
+    """按文件内容哈希缓存 Dataset（_file_bytes 不参与哈希），直接从内存解析；
+    所有会话共享，只保留最近 4 个，避免上传过的文件一直占着服务器内存"""
+    return Dataset(_file_bytes, suffix=suffix)
+
+
+ANSWER_CACHE_MAX_CONTEXTS = 16   # 问答缓存保留的数据集上下文数，最久未用的先淘汰
+ANSWER_CACHE_MAX_ANSWERS = 200   # 每个上下文保留的回答数，最早写入的先淘汰
+
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    """进程内问答缓存: ({数据上下文指纹: {规范化问题: 回答}}, 锁)，同一问题直接复用回答；
+    所有会话共享，由 get_answers 按最近使用裁剪"""
+    return OrderedDict(), threading.Lock()
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_dataframe(dataset_key: str, _dataset):
+    """按数据集缓存完整 DataFrame（_dataset 不参与哈希），每个数据集只构建一次"""
+    df = pd.DataFrame(_dataset.data, columns=_dataset.headers)
+    # 数值列直接用 Dataset 已解析好的 float64 数组（与统计口径一致，"$1,200" 也算数值），
+    # 不再用 pd.to_numeric 逐格重新解析
+    for col, col_type in _dataset.col_types.items():
+        if col_type == "numeric":
+            df[col] = _dataset.numeric_column(col)
+    return df
+
+
+# 逐行绘制的图表（折线/散点/原始柱状）最多画这么多行，超出时均匀抽样
+MAX_PLOT_ROWS = 50_000
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_plot_frame(dataset_key: str, _dataset):
+    """按数据集缓存绘图用的 DataFrame：行数超过 MAX_PLOT_ROWS 时固定种子抽样并保持原顺序"""
+    df = get_dataframe(dataset_key, _dataset)
+    if len(df) <= MAX_PLOT_ROWS:
+        return df
+    return df.sample(MAX_PLOT_ROWS, random_state=0).sort_index()
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def get_group_totals(dataset_key: str, _df, x_col: str, y_col=None):
+    """按 (数据集, 分组列, 数值列) 缓存聚合：有数值列按组求和，否则按值计数；切换图表类型不再重新 groupby"""
+    if y_col is None:
+        return _df[x_col].value_counts()
+    return _df.groupby(x_col, sort=False, observed=True)[y_col].sum()
+
+
+# 数据预览每页行数
+PREVIEW_PAGE_ROWS = 100
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def get_preview_table(dataset_key: str, _dataset, page: int = 1):
+    """按 (数据集, 页码) 缓存一页预览的 Arrow 表，翻页、切换标签页时 st.dataframe 不再重复转换"""
+    df = get_dataframe(dataset_key, _dataset)
+    start = (page - 1) * PREVIEW_PAGE_ROWS
+    return pa.Table.from_pandas(df.iloc[start:start + PREVIEW_PAGE_ROWS], preserve_index=False)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_column_info(dataset_key: str, _dataset):
+    """按列构建固定 schema 的列信息 Arrow 表，不适用的字段为空值，渲染时无需逐行推断"""
+    headers = _dataset.headers
+    col_types = pd.Series(_dataset.col_types, dtype="string").reindex(headers).fillna("unknown")
+    details = pd.DataFrame.from_dict(
+        _dataset.type_details, orient="index", columns=["empty_pct", "unique"]
+    ).reindex(headers)
+    stats = pd.DataFrame.from_dict(
+        _dataset.stats, orient="index", columns=["mean", "min", "max"]
+    ).reindex(headers)
+    
+    return pa.Table.from_pandas(pd.DataFrame({
+        "列名": pd.array(headers, dtype="string"),
+        "类型": col_types.array,
+        "非空%": details["empty_pct"].rsub(100).round(0).astype("Float64").array,
+        "均值": stats["mean"].astype("Float64").array,
+        "最小": stats["min"].astype("Float64").array,
+        "最大": stats["max"].astype("Float64").array,
+        "唯一值": details["unique"].where(col_types.eq("text").to_numpy()).astype("Int64").array,
+    }), preserve_index=False)
+
+
+@st.cache_resource(show_spinner=False)
+def get_connector(conn_str: str):
+    """按连接串缓存已连接的 DatabaseConnector（PostgreSQL 带连接池），重新渲染不再重连"""
+    return DatabaseConnector(conn_str).connect()
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def build_table_dataset(conn_str: str, table_name: str, row_count: int, limit: int = 5000):
+    """按 (连接串, 表名, 行数) 缓存数据库表的 Dataset，分批读取一次，不再经 CSV 中转；
+    只保留最近 4 个，换表、改行数上限不会让旧的 Dataset 一直留在内存里"""
+    headers, rows = get_connector(conn_str).iter_table_rows(table_name, limit=limit)
+    return Dataset(headers=headers, rows=rows)
+
+
+def build_prompt_context(dataset) -> str:
+    """数据集加载时生成一次 prompt 上下文（schema + 样本 + 统计），多轮提问直接复用"""
+    return (
+        f"{dataset.schema_prompt}\n\n"
+        f"数据样本:\n{dataset.sample_table(10)}\n\n"
+        f"统计摘要:\n{dataset.stats_text()}"
+    )
+
+
+def build_question_prompt(prompt_context: str, question: str) -> str:
+    """构造单个问题的 LLM prompt"""
+    return f"""你是一个数据分析专家。基于以下数据集信息回答用户问题。
+
+{prompt_context}
+
+用户问题: {question}
+
+请用简洁的中文回答，如果需要计算，展示计算过程。如果无法从数据中得出答案，请说明原因。"""
+
+
+def get_answers(prompt_context: str):
+    """返回 (context_key, 问答缓存)，问答缓存按数据集上下文分区"""
+    context_key = hashlib.sha256(prompt_context.encode("utf-8")).hexdigest()
+    cache, lock = get_answer_cache()
+    with lock:
+        answers = cache.setdefault(context_key, {})
+        cache.move_to_end(context_key)
+        while len(cache) > ANSWER_CACHE_MAX_CONTEXTS:
+            cache.popitem(last=False)
+        # 回答由后台线程写入，这里只删除最早写入的
+        for key in list(answers)[:-ANSWER_CACHE_MAX_ANSWERS]:
+            answers.pop(key, None)
+    return context_key, answers
+
+
+QUICK_QUESTIONS = [
+    "这个数据集的主要特征是什么？",
+    "有哪些异常值需要注意？",
+    "给我一些数据洞察",
+    "数据质量如何？有什么问题？"
+]
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm_jobs():
+    """所有会话共用的后台 LLM 线程池，以及快捷问题预热任务 context_key -> Future"""
+    return ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS), {}
+
+
+def wait_with_progress(future, label: str = "分析中..."):
+    """
+    轮询等待后台任务，每 0.2 秒刷新一次已等待时间
+    
+    脚本线程不再阻塞在 LLM 调用里：用户点击其他控件时本次运行能及时中断，任务继续在后台完成
+    """
+    status = st.empty()
+    start = time.monotonic()
+    while not wait([future], timeout=0.2)[0]:
+        status.caption(f"⏳ {label} 已等待 {time.monotonic() - start:.0f} 秒")
+    status.empty()
+
+
+def prewarm_quick_answers(prompt_context: str):
+    """数据集加载后在后台用一次批量请求预先回答快捷问题，结果写入问答缓存"""
+    context_key, answers = get_answers(prompt_context)
+    pool, jobs = get_llm_jobs()
+    if context_key in jobs:
+        return
+    
+    def run():
+        pending = [q for q in QUICK_QUESTIONS if find_cached_question(q, answers) is None]
+        if not pending:
+            return
+        text = llm_query(build_question_prompt(prompt_context, build_batch_question(pending)))
+        if text.startswith("❌"):
+            return
+        for q, answer in zip(pending, split_batch_answers(text, len(pending))):
+            if answer:
+                answers[normalize_question(q)] = answer
+    
+    jobs[context_key] = pool.submit(run)
 
 # ---------------------------------------------------------------------------
 # Sidebar - Data Source
@@ -81,21 +307,26 @@ if data_source == "📁 上传 CSV":
     )
     
     if uploaded_file:
-        # 保存到临时文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
-            tmp.write(uploaded_file.getvalue())
-            tmp_path = tmp.name
-        
         try:
-            headers, data, _ = load_csv(tmp_path)
-            st.session_state.headers = headers
-            st.session_state.data = data
-            st.session_state.dataset = Dataset(tmp_path)
-            st.sidebar.success(f"✅ 已加载 {len(data)} 行数据")
+            # 同一次上传在重新渲染时 file_id 不变，连哈希都不用重算；
+            # 重新上传则按内容哈希判断，内容一致就跳过解析
+            suffix = Path(uploaded_file.name).suffix.lower() or ".csv"
+            file_bytes = uploaded_file.getvalue()
+            upload_id, file_hash = st.session_state.upload_hash
+            if upload_id != uploaded_file.file_id:
+                file_hash = content_hash(file_bytes) + suffix
+                st.session_state.upload_hash = (uploaded_file.file_id, file_hash)
+            if st.session_state.dataset_key != file_hash:
+                dataset = build_dataset(file_hash, file_bytes, suffix)
+                st.session_state.headers = dataset.headers
+                st.session_state.data = dataset.data
+                st.session_state.dataset = dataset
+                st.session_state.prompt_context = build_prompt_context(dataset)
+                prewarm_quick_answers(st.session_state.prompt_context)
+                st.session_state.dataset_key = file_hash
+            st.sidebar.success(f"✅ 已加载 {len(st.session_state.data)} 行数据")
         except Exception as e:
             st.sidebar.error(f"❌ 加载失败: {e}")
-        finally:
-            os.unlink(tmp_path)
 
 elif data_source == "🗄️ 数据库连接":
     st.sidebar.markdown("**连接字符串**")
@@ -123,8 +354,7 @@ elif data_source == "🗄️ 数据库连接":
     if st.sidebar.button("🔗 连接"):
         if conn_str:
             try:
-                db = DatabaseConnector(conn_str)
-                db.connect()
+                db = get_connector(conn_str)
                 st.session_state.db_connector = db
                 st.sidebar.success(f"✅ 已连接 ({db.db_type})")
             except Exception as e:
@@ -143,21 +373,22 @@ elif data_source == "🗄️ 数据库连接":
         
         if selected_table and st.sidebar.button("📊 加载表"):
             try:
-                headers, rows = db.query_table(selected_table, limit=5000)
-                st.session_state.headers = headers
-                st.session_state.data = list(rows)
-                
-                # 创建临时 CSV 用于 Dataset
-                csv_content = db.table_to_csv_string(selected_table, limit=5000)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".csv", mode="w") as tmp:
-                    tmp.write(csv_content)
-                    tmp_path = tmp.name
-                
-                st.session_state.dataset = Dataset(tmp_path)
-                row_count = db.get_table_row_count(selected_table)
-                st.sidebar.success(f"✅ 已加载 {selected_table} ({row_count} 行)")
-                
-                os.unlink(tmp_path)
+                # PostgreSQL 用统计信息估算行数，不做全表 COUNT(*)
+                row_count = db.get_table_row_count(selected_table, estimate=True)
+                dataset = build_table_dataset(
+                    db.connection_string, selected_table, row_count
+                )
+                st.session_state.headers = dataset.headers
+                st.session_state.data = dataset.data
+                st.session_state.dataset = dataset
+                st.session_state.prompt_context = build_prompt_context(dataset)
+                prewarm_quick_answers(st.session_state.prompt_context)
+                st.session_state.dataset_key = "db:" + hashlib.blake2b(
+                    f"{db.connection_string}\0{selected_table}\0{row_count}".encode("utf-8"),
+                    digest_size=16,
+                ).hexdigest()
+                approx = "≈" if db.db_type == "postgresql" else ""
+                st.sidebar.success(f"✅ 已加载 {selected_table} ({approx}{row_count:,} 行)")
             except Exception as e:
                 st.sidebar.error(f"❌ 加载失败: {e}")
 
@@ -190,8 +421,10 @@ if st.session_state.dataset is None:
 
 else:
     dataset = st.session_state.dataset
+    dataset_key = st.session_state.dataset_key
     headers = st.session_state.headers
     data = st.session_state.data
+    numeric_cols = tuple(h for h in headers if dataset.col_types.get(h) == "numeric")
     
     # Tabs
     tab_overview, tab_ask, tab_viz, tab_quality = st.tabs([
@@ -202,310 +435,344 @@ else:
     # Tab: 数据概览
     # ---------------------------------------------------------------------------
     with tab_overview:
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            st.metric("行数", f"{len(data):,}")
-        with col2:
-            st.metric("列数", len(headers))
-        with col3:
-            quality = dataset.quality
-            st.metric("数据质量", f"{quality.get('score', 0):.0f}%")
-        with col4:
-            outliers = dataset.outliers
-            outlier_count = sum(len(v) for v in outliers.values())
-            st.metric("异常值", outlier_count)
-        
-        st.markdown("---")
-        
-        # 列信息
-        st.subheader("📋 列信息")
-        
-        col_info = []
-        col_types = dataset.col_types
-        stats = dataset.stats
-        
-        for i, h in enumerate(headers):
-            col_type = col_types.get(h, "unknown")
-            col_stats = stats.get(h, {})
+        # 概览是一个 fragment：翻页只重新运行这一块
+        @st.fragment
+        def overview_panel():
+            col1, col2, col3, col4 = st.columns(4)
             
-            info = {
-                "列名": h,
-                "类型": col_type,
-                "非空": f"{col_stats.get('non_null_pct', 0):.0f}%"
-            }
+            with col1:
+                st.metric("行数", f"{len(data):,}")
+            with col2:
+                st.metric("列数", len(headers))
+            with col3:
+                quality = dataset.quality
+                st.metric("数据质量", f"{quality.get('overall', 0):.0f}%")
+            with col4:
+                st.metric("异常值", dataset.outlier_count)
             
-            if col_type == "numeric":
-                info["均值"] = f"{col_stats.get('mean', 0):.2f}"
-                info["最小"] = col_stats.get('min', '-')
-                info["最大"] = col_stats.get('max', '-')
-            elif col_type == "categorical":
-                info["唯一值"] = col_stats.get('unique', '-')
+            st.markdown("---")
             
-            col_info.append(info)
-        
-        st.dataframe(col_info, use_container_width=True)
-        
-        # 数据预览
-        st.subheader("👀 数据预览")
-        preview_data = data[:100]
-        
-        import pandas as pd
-        df = pd.DataFrame(preview_data, columns=headers)
-        st.dataframe(df, use_container_width=True, height=400)
+            # 列信息
+            st.subheader("📋 列信息")
+            
+            st.dataframe(get_column_info(dataset_key, dataset), use_container_width=True)
+            
+            # 数据预览：按页渲染缓存的 Arrow 表，每页 PREVIEW_PAGE_ROWS 行
+            st.subheader("👀 数据预览")
+            n_pages = max(1, -(-len(data) // PREVIEW_PAGE_ROWS))
+            page = 1
+            if n_pages > 1:
+                page = st.number_input(f"页码（共 {n_pages} 页）", min_value=1, max_value=n_pages, value=1, key="preview_page")
+            preview = get_preview_table(dataset_key, dataset, int(page))
+            st.dataframe(preview, use_container_width=True, height=400)
+        
+        overview_panel()
     
     # ---------------------------------------------------------------------------
     # Tab: 提问分析
     # ---------------------------------------------------------------------------
     with tab_ask:
-        st.subheader("💬 用自然语言分析数据")
-        
-        # 辅助函数：处理问题并获取 AI 回答
-        def process_question(question: str):
-            """调用 LLM 处理问题并返回回答"""
-            schema = dataset.schema_prompt
-            sample = dataset.sample_table(10)
-            stats_text = dataset.stats_text
+        # 提问区是一个 fragment：提问、点快捷问题只重新运行这一块，其他标签页不跟着重算
+        @st.fragment
+        def ask_panel():
+            st.subheader("💬 用自然语言分析数据")
             
-            prompt = f"""你是一个数据分析专家。基于以下数据集信息回答用户问题。
-
-{schema}
-
-数据样本:
-{sample}
-
-统计摘要:
-{stats_text}
-
-用户问题: {question}
-
-请用简洁的中文回答，如果需要计算，展示计算过程。如果无法从数据中得出答案，请说明原因。"""
-
-            return llm_query(prompt)
-        
-        # 检查是否有待处理的问题（最后一条是 user 但没有 assistant 回复）
-        pending_question = None
-        if st.session_state.chat_history:
-            last_msg = st.session_state.chat_history[-1]
-            if last_msg["role"] == "user":
-                pending_question = last_msg["content"]
-        
-        # 显示聊天历史（除了待处理的问题）
-        history_to_show = st.session_state.chat_history[:-1] if pending_question else st.session_state.chat_history
-        for msg in history_to_show:
-            with st.chat_message(msg["role"]):
-                st.markdown(msg["content"])
-        
-        # 处理待处理的问题
-        if pending_question:
-            with st.chat_message("user"):
-                st.markdown(pending_question)
+            # 数据集上下文在加载时已生成，这里只拼接问题
+            if st.session_state.prompt_context is None:
+                st.session_state.prompt_context = build_prompt_context(dataset)
+            prompt_context = st.session_state.prompt_context
+            
+            def ask_llm(questions):
+                """多个问题按 LLM_BATCH_SIZE 分组合并成一个 prompt，解析失败的问题再单独请求"""
+                if len(questions) <= 1:
+                    return llm_query_many([build_question_prompt(prompt_context, q) for q in questions])
+                
+                groups = [
+                    list(range(start, min(start + LLM_BATCH_SIZE, len(questions))))
+                    for start in range(0, len(questions), LLM_BATCH_SIZE)
+                ]
+                batched = llm_query_many([
+                    build_question_prompt(prompt_context, build_batch_question([questions[i] for i in group]))
+                    for group in groups
+                ])
+                
+                responses = [None] * len(questions)
+                for group, text in zip(groups, batched):
+                    if text.startswith("❌"):
+                        for i in group:
+                            responses[i] = text
+                        continue
+                    for i, answer in zip(group, split_batch_answers(text, len(group))):
+                        responses[i] = answer
+                
+                retry = [i for i, r in enumerate(responses) if r is None]
+                if retry:
+                    fresh = llm_query_many([build_question_prompt(prompt_context, questions[i]) for i in retry])
+                    for i, response in zip(retry, fresh):
+                        responses[i] = response
+                return responses
+            
+            context_key, answers = get_answers(prompt_context)
+            
+            def answer_questions(questions):
+                """先查问答缓存（按规范化后的问题精确匹配），只把未命中的问题合并发给 LLM"""
+                responses = [None] * len(questions)
+                misses = []
+                for i, q in enumerate(questions):
+                    hit = find_cached_question(q, answers)
+                    if hit is not None:
+                        responses[i] = answers[hit]
+                    else:
+                        misses.append(i)
+                
+                if misses:
+                    fresh = ask_llm([questions[i] for i in misses])
+                    for i, response in zip(misses, fresh):
+                        responses[i] = response
+                        if not response.startswith("❌"):
+                            answers[normalize_question(questions[i])] = response
+                return responses
+            
+            # 聊天区域先占位，输入框和快捷问题放在下方，本次运行直接回答，不再 st.rerun()
+            chat_history = st.session_state.chat_history
+            chat_box = st.container()
+            
+            # 用户输入
+            new_questions = []
+            user_question = st.chat_input("输入你的问题，例如：哪个产品销售额最高？")
+            if user_question:
+                new_questions.append(user_question)
+            
+            # 快捷问题
+            st.markdown("---")
+            st.caption("💡 快捷问题")
+            
+            cols = st.columns(2)
+            for i, q in enumerate(QUICK_QUESTIONS):
+                if cols[i % 2].button(q, key=f"quick_{i}"):
+                    new_questions.append(q)
+            
+            if st.button("🚀 批量分析常见问题", key="quick_all"):
+                new_questions.extend(QUICK_QUESTIONS)
             
-            with st.chat_message("assistant"):
-                with st.spinner("分析中..."):
+            # 快捷问题的后台预热还没结束就等它，避免同一问题重复请求 LLM
+            job = get_llm_jobs()[1].get(context_key)
+            if job is not None and not job.done() and any(q in QUICK_QUESTIONS for q in new_questions):
+                wait_with_progress(job)
+            
+            with chat_box:
+                # 显示聊天历史
+                for msg in chat_history:
+                    with st.chat_message(msg["role"]):
+                        st.markdown(msg["content"])
+                
+                # 单个未缓存的问题：流式输出，边生成边显示
+                if len(new_questions) == 1 and find_cached_question(new_questions[0], answers) is None:
+                    question = new_questions[0]
+                    with st.chat_message("user"):
+                        st.markdown(question)
+                    with st.chat_message("assistant"):
+                        # gemini 中途失败（非零退出、超时）时 llm_query_stream 抛出 LLMStreamError，
+                        # 已显示的半截回答不算成功，不写入问答缓存
+                        try:
+                            response = st.write_stream(
+                                llm_query_stream(build_question_prompt(prompt_context, question))
+                            ).strip()
+                        except Exception as e:
+                            response = f"❌ 分析失败: {e}"
+                            st.error(response)
+                    if not response.startswith("❌"):
+                        answers[normalize_question(question)] = response
+                    chat_history.append({"role": "user", "content": question})
+                    chat_history.append({"role": "assistant", "content": response})
+                
+                # 其余情况：多个问题合并成一次 LLM 请求，缓存命中直接返回；在后台线程池执行
+                elif new_questions:
+                    future = get_llm_jobs()[0].submit(answer_questions, new_questions)
+                    st.session_state.pending_answers.append((new_questions, future))
+                    wait_with_progress(future)
+                
+                # 后台回答完成后再写入聊天记录；上次运行被打断时，结果在这里补上。
+                # 前一批还没回答完时可以继续提问，所以每批单独记录、完成一批写入一批
+                pending = st.session_state.pending_answers
+                for questions, future in [p for p in pending if p[1].done()]:
+                    pending.remove((questions, future))
                     try:
-                        response = process_question(pending_question)
-                        st.markdown(response)
-                        
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": response
-                        })
+                        responses = future.result()
                     except Exception as e:
-                        error_msg = f"分析失败: {e}"
-                        st.error(error_msg)
-                        st.session_state.chat_history.append({
-                            "role": "assistant",
-                            "content": f"❌ {error_msg}"
-                        })
-        
-        # 用户输入
-        user_question = st.chat_input("输入你的问题，例如：哪个产品销售额最高？")
-        
-        if user_question:
-            # 添加用户消息并触发重新渲染
-            st.session_state.chat_history.append({
-                "role": "user",
-                "content": user_question
-            })
-            st.rerun()
-        
-        # 快捷问题
-        st.markdown("---")
-        st.caption("💡 快捷问题")
-        
-        quick_questions = [
-            "这个数据集的主要特征是什么？",
-            "有哪些异常值需要注意？",
-            "给我一些数据洞察",
-            "数据质量如何？有什么问题？"
-        ]
+                        responses = [f"❌ 分析失败: {e}"] * len(questions)
+                    
+                    for question, response in zip(questions, responses):
+                        with st.chat_message("user"):
+                            st.markdown(question)
+                        with st.chat_message("assistant"):
+                            st.markdown(response)
+                        chat_history.append({"role": "user", "content": question})
+                        chat_history.append({"role": "assistant", "content": response})
+                
+                if pending:
+                    st.info(f"⏳ 还有 {sum(len(p[0]) for p in pending)} 个问题在后台分析中")
+                    st.button("🔄 查看结果", key="pending_refresh")
         
-        cols = st.columns(2)
-        for i, q in enumerate(quick_questions):
-            if cols[i % 2].button(q, key=f"quick_{i}"):
-                st.session_state.chat_history.append({"role": "user", "content": q})
-                st.rerun()
+        ask_panel()
     
     # ---------------------------------------------------------------------------
     # Tab: 可视化
     # ---------------------------------------------------------------------------
     with tab_viz:
-        st.subheader("📈 数据可视化")
-        
-        import pandas as pd
-        import matplotlib.pyplot as plt
-        
-        # 创建 DataFrame
-        df = pd.DataFrame(data, columns=headers)
-        
-        viz_suggestions = dataset.viz_suggestions
-        
-        if viz_suggestions:
-            st.markdown("**🎯 推荐图表**")
+        # 可视化是一个 fragment：选列、切换图表类型、生成图表只重新运行这一块，其他标签页不跟着重算
+        @st.fragment
+        def viz_panel():
+            st.subheader("📈 数据可视化")
             
-            for i, viz in enumerate(viz_suggestions[:5]):
-                viz_type = viz.get('type', 'bar')
-                viz_title = viz.get('title', '图表')
-                viz_cols = viz.get('columns', [])
-                viz_desc = viz.get('description', '-')
+            # 每个数据集只构建一次 DataFrame，按钮点击不再重建
+            df = get_dataframe(dataset_key, dataset)
+            # 聚合类图表用全量 df，逐行绘制的图表用抽样后的 plot_df
+            plot_df = get_plot_frame(dataset_key, dataset)
+            
+            viz_suggestions = dataset.viz_suggestions
+            
+            if viz_suggestions:
+                st.markdown("**🎯 推荐图表**")
                 
-                with st.expander(f"{viz_title} ({viz_type})"):
-                    # 可编辑的描述
-                    edited_desc = st.text_input(
-                        "描述", 
-                        value=viz_desc, 
-                        key=f"desc_{i}"
-                    )
-                    
-                    # 可选择的列
-                    edited_cols = st.multiselect(
-                        "选择列",
-                        options=headers,
-                        default=[c for c in viz_cols if c in headers],
-                        key=f"cols_{i}"
-                    )
+                for i, viz in enumerate(viz_suggestions[:5]):
+                    viz_type = viz.get('type', 'bar')
+                    viz_title = viz.get('title', '图表')
+                    viz_cols = viz.get('columns', [])
+                    viz_desc = viz.get('description', '-')
                     
-                    # 图表类型选择
-                    chart_types = ["bar", "line", "scatter", "pie", "histogram"]
-                    edited_type = st.selectbox(
-                        "图表类型",
-                        options=chart_types,
-                        index=chart_types.index(viz_type) if viz_type in chart_types else 0,
-                        key=f"type_{i}"
-                    )
-                    
-                    viz_cols = edited_cols  # 使用编辑后的列
-                    viz_type = edited_type  # 使用编辑后的类型
-                    
-                    if st.button("📊 生成图表", key=f"viz_{i}"):
-                        try:
-                            # 根据推荐类型生成图表
-                            if len(viz_cols) >= 2:
-                                x_col, y_col = viz_cols[0], viz_cols[1]
-                            elif len(viz_cols) == 1:
-                                x_col = viz_cols[0]
-                                y_col = None
-                            else:
-                                st.warning("没有指定列")
-                                continue
-                            
-                            if viz_type in ['line', '折线图', 'trend']:
-                                if y_col:
-                                    st.line_chart(df.set_index(x_col)[y_col])
-                                else:
-                                    st.line_chart(df[x_col])
-                            elif viz_type in ['bar', '柱状图', 'comparison']:
-                                if y_col:
-                                    # 聚合数据
-                                    agg_df = df.groupby(x_col)[y_col].sum().reset_index()
-                                    st.bar_chart(agg_df.set_index(x_col))
-                                else:
-                                    st.bar_chart(df[x_col].value_counts())
-                            elif viz_type in ['scatter', '散点图', 'correlation']:
-                                if y_col:
-                                    st.scatter_chart(df, x=x_col, y=y_col)
-                                else:
-                                    st.warning("散点图需要两列")
-                            elif viz_type in ['pie', '饼图', 'distribution']:
-                                fig, ax = plt.subplots(figsize=(8, 6))
-                                if y_col:
-                                    pie_data = df.groupby(x_col)[y_col].sum()
+                    with st.expander(f"{viz_title} ({viz_type})"):
+                        # 可编辑的描述
+                        edited_desc = st.text_input(
+                            "描述", 
+                            value=viz_desc, 
+                            key=f"desc_{i}"
+                        )
+                        
+                        # 可选择的列
+                        edited_cols = st.multiselect(
+                            "选择列",
+                            options=headers,
+                            default=[c for c in viz_cols if c in headers],
+                            key=f"cols_{i}"
+                        )
+                        
+                        # 图表类型选择
+                        chart_types = ["bar", "line", "scatter", "pie", "histogram"]
+                        edited_type = st.selectbox(
+                            "图表类型",
+                            options=chart_types,
+                            index=chart_types.index(viz_type) if viz_type in chart_types else 0,
+                            key=f"type_{i}"
+                        )
+                        
+                        viz_cols = edited_cols  # 使用编辑后的列
+                        viz_type = edited_type  # 使用编辑后的类型
+                        
+                        if st.button("📊 生成图表", key=f"viz_{i}"):
+                            try:
+                                # 根据推荐类型生成图表
+                                if len(viz_cols) >= 2:
+                                    x_col, y_col = viz_cols[0], viz_cols[1]
+                                elif len(viz_cols) == 1:
+                                    x_col = viz_cols[0]
+                                    y_col = None
                                 else:
-                                    pie_data = df[x_col].value_counts()
-                                # 限制最多显示10个类别
-                                if len(pie_data) > 10:
-                                    pie_data = pie_data.head(10)
-                                ax.pie(pie_data.values, labels=pie_data.index, autopct='%1.1f%%')
-                                ax.set_title(viz_title)
-                                st.pyplot(fig)
-                                plt.close()
-                            elif viz_type in ['histogram', '直方图', 'hist']:
-                                fig, ax = plt.subplots(figsize=(8, 5))
-                                ax.hist(df[x_col].dropna(), bins=30, edgecolor='black')
-                                ax.set_xlabel(x_col)
-                                ax.set_ylabel("频率")
-                                ax.set_title(viz_title)
-                                st.pyplot(fig)
-                                plt.close()
-                            else:
-                                # 默认柱状图
-                                if y_col:
-                                    agg_df = df.groupby(x_col)[y_col].sum().reset_index()
-                                    st.bar_chart(agg_df.set_index(x_col))
+                                    st.warning("没有指定列")
+                                    continue
+                                
+                                if viz_type in ['line', '折线图', 'trend']:
+                                    if y_col:
+                                        st.line_chart(plot_df.set_index(x_col)[y_col])
+                                    else:
+                                        st.line_chart(plot_df[x_col])
+                                elif viz_type in ['bar', '柱状图', 'comparison']:
+                                    st.bar_chart(get_group_totals(dataset_key, df, x_col, y_col))
+                                elif viz_type in ['scatter', '散点图', 'correlation']:
+                                    if y_col:
+                                        st.scatter_chart(plot_df, x=x_col, y=y_col)
+                                    else:
+                                        st.warning("散点图需要两列")
+                                elif viz_type in ['pie', '饼图', 'distribution']:
+                                    fig, ax = plt.subplots(figsize=(8, 6))
+                                    try:
+                                        # 只取占比最大的 10 个类别
+                                        pie_data = get_group_totals(dataset_key, df, x_col, y_col).nlargest(10)
+                                        ax.pie(pie_data.values, labels=pie_data.index, autopct='%1.1f%%')
+                                        ax.set_title(viz_title)
+                                        st.pyplot(fig)
+                                    finally:
+                                        plt.close(fig)
+                                elif viz_type in ['histogram', '直方图', 'hist']:
+                                    fig, ax = plt.subplots(figsize=(8, 5))
+                                    try:
+                                        ax.hist(dataset.numeric_array(x_col), bins=30, edgecolor='black')
+                                        ax.set_xlabel(x_col)
+                                        ax.set_ylabel("频率")
+                                        ax.set_title(viz_title)
+                                        st.pyplot(fig)
+                                    finally:
+                                        plt.close(fig)
                                 else:
-                                    st.bar_chart(df[x_col].value_counts())
-                            
-                            st.success(f"✅ {viz_title}")
-                        except Exception as e:
-                            st.error(f"图表生成失败: {e}")
-        
-        st.markdown("---")
-        st.markdown("**🖌️ 自定义图表**")
-        
-        chart_type = st.selectbox(
-            "图表类型",
-            ["折线图", "柱状图", "散点图", "饼图", "直方图"]
-        )
-        
-        numeric_cols = [h for h in headers if dataset.col_types.get(h) == "numeric"]
-        categorical_cols = [h for h in headers if dataset.col_types.get(h) == "categorical"]
-        
-        if chart_type in ["折线图", "柱状图", "散点图"]:
-            col1, col2 = st.columns(2)
-            with col1:
-                x_col = st.selectbox("X 轴", headers)
-            with col2:
-                y_col = st.selectbox("Y 轴", numeric_cols if numeric_cols else headers)
-        elif chart_type == "饼图":
-            x_col = st.selectbox("分类列", categorical_cols if categorical_cols else headers)
-            y_col = st.selectbox("数值列", numeric_cols if numeric_cols else headers)
-        else:
-            x_col = st.selectbox("列", numeric_cols if numeric_cols else headers)
-            y_col = None
-        
-        if st.button("📊 生成图表", key="custom_chart"):
-            try:
-                if chart_type == "折线图":
-                    st.line_chart(df.set_index(x_col)[y_col])
-                elif chart_type == "柱状图":
-                    st.bar_chart(df.set_index(x_col)[y_col])
-                elif chart_type == "散点图":
-                    st.scatter_chart(df, x=x_col, y=y_col)
-                elif chart_type == "直方图":
-                    fig, ax = plt.subplots()
-                    ax.hist(df[x_col].dropna(), bins=30, edgecolor='black')
-                    ax.set_xlabel(x_col)
-                    ax.set_ylabel("频率")
-                    st.pyplot(fig)
-                elif chart_type == "饼图":
-                    import matplotlib.pyplot as plt
-                    pie_data = df.groupby(x_col)[y_col].sum()
-                    fig, ax = plt.subplots()
-                    ax.pie(pie_data.values, labels=pie_data.index, autopct='%1.1f%%')
-                    st.pyplot(fig)
-            except Exception as e:
-                st.error(f"图表生成失败: {e}")
+                                    # 默认柱状图
+                                    st.bar_chart(get_group_totals(dataset_key, df, x_col, y_col))
+                                
+                                st.success(f"✅ {viz_title}")
+                            except Exception as e:
+                                st.error(f"图表生成失败: {e}")
+            
+            st.markdown("---")
+            st.markdown("**🖌️ 自定义图表**")
+            
+            chart_type = st.selectbox(
+                "图表类型",
+                ["折线图", "柱状图", "散点图", "饼图", "直方图"]
+            )
+            
+            categorical_cols = [h for h in headers if dataset.col_types.get(h) == "text"]
+            
+            if chart_type in ["折线图", "柱状图", "散点图"]:
+                col1, col2 = st.columns(2)
+                with col1:
+                    x_col = st.selectbox("X 轴", headers)
+                with col2:
+                    y_col = st.selectbox("Y 轴", numeric_cols if numeric_cols else headers)
+            elif chart_type == "饼图":
+                x_col = st.selectbox("分类列", categorical_cols if categorical_cols else headers)
+                y_col = st.selectbox("数值列", numeric_cols if numeric_cols else headers)
+            else:
+                x_col = st.selectbox("列", numeric_cols if numeric_cols else headers)
+                y_col = None
+            
+            if st.button("📊 生成图表", key="custom_chart"):
+                try:
+                    if chart_type == "折线图":
+                        st.line_chart(plot_df.set_index(x_col)[y_col])
+                    elif chart_type == "柱状图":
+                        st.bar_chart(plot_df.set_index(x_col)[y_col])
+                    elif chart_type == "散点图":
+                        st.scatter_chart(plot_df, x=x_col, y=y_col)
+                    elif chart_type == "直方图":
+                        fig, ax = plt.subplots()
+                        try:
+                            ax.hist(dataset.numeric_array(x_col), bins=30, edgecolor='black')
+                            ax.set_xlabel(x_col)
+                            ax.set_ylabel("频率")
+                            st.pyplot(fig)
+                        finally:
+                            plt.close(fig)
+                    elif chart_type == "饼图":
+                        pie_data = get_group_totals(dataset_key, df, x_col, y_col).nlargest(10)
+                        fig, ax = plt.subplots()
+                        try:
+                            ax.pie(pie_data.values, labels=pie_data.index, autopct='%1.1f%%')
+                            st.pyplot(fig)
+                        finally:
+                            plt.close(fig)
+                except Exception as e:
+                    st.error(f"图表生成失败: {e}")
+        
+        viz_panel()
     
     # ---------------------------------------------------------------------------
     # Tab: 数据质量
@@ -567,10 +834,13 @@ else:
         
         outliers = dataset.outliers
         if outliers:
-            for col, vals in outliers.items():
-                if vals:
-                    with st.expander(f"{col} - {len(vals)} 个异常值"):
-                        st.write(vals[:20])
+            for col, info in outliers.items():
+                with st.expander(f"{col} - {info['count']} 个异常值 ({info['percentage']}%)"):
+                    st.caption(f"正常范围 [{info['lower_bound']}, {info['upper_bound']}]")
+                    st.dataframe(
+                        pd.DataFrame({"行号": info["rows"], "值": info["values"]}),
+                        hide_index=True,
+                    )
         else:
             st.info("未检测到异常值")
 
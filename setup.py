@@ -19,10 +19,11 @@ setup(
         "requests",
     ],
     extras_require={
-        "web": ["streamlit", "pandas", "matplotlib"],
+        "web": ["streamlit>=1.37.0", "pandas", "matplotlib"],
         "db": ["psycopg2-binary"],
         "excel": ["openpyxl", "xlrd"],
-        "full": ["streamlit", "pandas", "matplotlib", "psycopg2-binary", "openpyxl", "xlrd", "tabulate"],
+        "perf": ["xxhash", "orjson"],
+        "full": ["streamlit>=1.37.0", "pandas", "matplotlib", "psycopg2-binary", "openpyxl", "xlrd", "tabulate"],
     },
     entry_points={
         "console_scripts": [
@@ -8,17 +8,25 @@ data quality scoring, visualization recommendations, and more.
 """
 
 import argparse
+import codecs
+import contextlib
 import csv
+import functools
+import gc
+import hashlib
 import io
+import itertools
 import json
 import logging
 import math
 import os
 import re
+import shutil
 import subprocess
 import sys
-import tempfile
+import threading
 import time
+from collections import Counter, deque
 from datetime import datetime
 from pathlib import Path
 
@@ -29,13 +37,38 @@ VERSION = "0.2.0"
 MAX_PREVIEW_ROWS = 20          # rows sent to LLM for schema understanding
 MAX_ANALYSIS_ROWS = 200        # rows sent for deep analysis
 MAX_CELL_LEN = 200             # truncate long cell values
+SMART_SAMPLE_ROWS = 15         # rows in DataContext.smart_sample (head + spread + tail)
+SMART_SAMPLE_CELL_LEN = 40     # cell width in DataContext.smart_sample
+SCAN_ROWS = 10_000             # rows `info` analyzes unless --full is given
+SCHEMA_ROWS = 200              # rows plot/query load: their prompts only describe the schema
+NUMPY_MIN_VALUES = 10_000      # use NumPy kernels (if installed) from this column size up
+STATS_MAX_WORKERS = os.cpu_count() or 1  # threads for per-column NumPy stats on wide files
+ENCODING_SAMPLE_BYTES = 64 * 1024  # leading bytes used to pick the file encoding
+DEDUPE_SAMPLE_ROWS = 1000      # rows sampled to find low-cardinality columns while loading
+DEDUPE_MAX_UNIQUE = 0.1        # share of distinct sampled values below which cells are shared
+CSV_ENCODINGS = ("utf-8", "utf-8-sig", "gbk", "gb2312", "latin-1")
+CSV_DELIMITERS = ",\t;|"        # candidates for delimiter detection, preferred first on ties
 STATE_DIR = Path.home() / ".csvwise"
-HISTORY_FILE = STATE_DIR / "history.json"
+HISTORY_FILE = STATE_DIR / "history.jsonl"
+LEGACY_HISTORY_FILE = STATE_DIR / "history.json"  # pre-JSONL history, read until the first rotation
+HISTORY_MAX_ENTRIES = 100      # entries kept when the history file is rotated
+HISTORY_ROTATE_BYTES = 256 * 1024  # rotate past this size (well above 100 entries of <~1 KB)
+HISTORY_TAIL_BYTES = 64 * 1024  # bytes read from the end of the file to list recent entries
 LOG_FILE = STATE_DIR / "csvwise.log"
+LLM_CACHE_FILE = STATE_DIR / "llm_cache.db"
+LLM_CACHE_ENABLED = True       # persistent prompt→response cache (disable with --no-cache)
+LLM_CACHE_TTL = 7 * 24 * 3600  # seconds a cached LLM response stays valid
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024  # response bytes kept; least recently used go first
+ANALYTICS_CACHE_DIR = STATE_DIR / "cache"
+ANALYTICS_CACHE_TTL = 7 * 24 * 3600  # analytics files unused this long are deleted
+ANALYTICS_CACHE_MAX_BYTES = 100 * 1024 * 1024  # cache dir size; least recently used go first
+ANALYTICS_CACHE_ENABLED = False  # on-disk analytics per input file; main() turns it on unless --no-cache
 
 LLM_TIMEOUT = 90               # default LLM timeout seconds
 LLM_MAX_RETRIES = 2            # max retry attempts for LLM calls
 LLM_RETRY_DELAY = 3            # seconds between retries
+LLM_MAX_WORKERS = 4            # max concurrent LLM calls in llm_query_many
+LLM_BATCH_SIZE = 8             # max questions row-marshaled into one LLM prompt
 
 # Advanced type detection patterns
 PATTERNS = {
@@ -49,11 +82,61 @@ PATTERNS = {
     "ip_address": re.compile(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$"),
 }
 
+# All PATTERNS as one anchored alternation, tried in dict order; the name of
+# the matching group (m.lastgroup) is the pattern name
+_PATTERN_RE = re.compile("^(?:%s)$" % "|".join(
+    "(?P<%s>%s%s)" % (
+        name,
+        "(?i:" if pat.flags & re.IGNORECASE else "(?:",
+        pat.pattern[1:-1] + ")",
+    )
+    for name, pat in PATTERNS.items()
+))
+
+_QUESTION_NOISE_RE = re.compile(r"[\W_]+")
+# Fenced code in LLM replies; an unclosed fence runs to the end of the text
+_PYTHON_BLOCK_RE = re.compile(r"```python(.*?)(?:```|\Z)", re.DOTALL)
+_CODE_BLOCK_RE = re.compile(r"```(?:[\w+-]*\n)?(.*?)(?:```|\Z)", re.DOTALL)
+_BATCH_MARKER_RE = re.compile(r"^\s*={3,}\s*Q(\d+)\s*={3,}\s*$", re.MULTILINE)
+
 DATE_FORMATS = (
     "%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%d/%m/%Y",
     "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S",
     "%Y年%m月%d日", "%m-%d-%Y",
 )
+_DATE_SEPARATOR_RE = re.compile(r"[-/年]")
+
+# DATE_FORMATS as regexes made of strptime's own field patterns (see
+# _strptime.TimeRE); a full match plus the datetime() day-of-month check
+# accepts what datetime.strptime(val, fmt) does, without raising on misses
+_STRPTIME_FIELDS = {
+    "Y": r"(?P<Y>\d\d\d\d)",
+    "m": r"(?P<m>1[0-2]|0[1-9]|[1-9])",
+    "d": r"(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])",
+    "H": r"(?P<H>2[0-3]|[0-1]\d|\d)",
+    "M": r"(?P<M>[0-5]\d|\d)",
+    "S": r"(?P<S>[0-5]\d|\d)",  # strptime also matches 60/61, which datetime() rejects
+}
+
+
+def _strptime_regex(fmt):
+    """Compile a DATE_FORMATS entry into a regex (strptime: whitespace matches
+    any run of whitespace, case is ignored)."""
+    def part(m):
+        if m[1]:
+            return _STRPTIME_FIELDS[m[1]]
+        return r"\s+" if m[2] else re.escape(m[0])
+    return re.compile(re.sub(r"%(\w)|(\s+)|.", part, fmt), re.IGNORECASE)
+
+
+_DATE_FORMAT_RES = tuple(_strptime_regex(fmt) for fmt in DATE_FORMATS)
+
+# ASCII first characters a (stripped) cell can have and still parse as a
+# number, counting the ",%¥$" noise removed before float(): digits, sign, ".",
+# and the i/n of inf/nan. Other ASCII starts are rejected without raising
+# ValueError; non-ASCII starts still go to float(), which also accepts
+# Unicode digits such as fullwidth "１２" or Arabic-Indic "٣".
+_NUMBER_START = frozenset("0123456789+-.iInN,%¥$")
 
 # ---------------------------------------------------------------------------
 # Logging
@@ -82,23 +165,67 @@ def ensure_state_dir():
     STATE_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def load_excel(path: str):
-    """Load Excel file (.xlsx, .xls) and return (headers, rows)."""
+@contextlib.contextmanager
+def _gc_paused():
+    """Suspend the cyclic garbage collector while building many rows.
+
+    Rows are lists of strings and never form cycles, but each one counts as
+    a GC allocation, so a large load keeps triggering collections that
+    rescan every row built so far.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """Return the numpy module if installed, else None (optional acceleration)."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@functools.lru_cache(maxsize=None)
+def _orjson():
+    """Return the orjson module if installed, else None (faster JSON parsing)."""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def load_excel(path, suffix: str = None, max_rows=None):
+    """Load Excel file (.xlsx, .xls) and return (headers, rows).
+
+    path may also be a binary buffer, in which case suffix picks the engine.
+    """
     try:
         import pandas as pd
     except ImportError:
         print("❌ 需要安装 pandas 和 openpyxl: pip install pandas openpyxl xlrd")
         sys.exit(1)
     
-    p = Path(path)
-    logger.info("Loading Excel: %s (%.1f KB)", path, p.stat().st_size / 1024)
+    if suffix is None:
+        p = Path(path)
+        suffix = p.suffix
+        logger.info("Loading Excel: %s (%.1f KB)", path, p.stat().st_size / 1024)
+    else:
+        logger.info("Loading Excel from memory (%s)", suffix)
     
     try:
         # 读取 Excel，支持 .xlsx 和 .xls
-        if p.suffix.lower() == ".xls":
-            df = pd.read_excel(path, engine="xlrd")
+        if suffix.lower() == ".xls":
+            df = pd.read_excel(path, engine="xlrd", nrows=max_rows)
         else:
-            df = pd.read_excel(path, engine="openpyxl")
+            df = pd.read_excel(path, engine="openpyxl", nrows=max_rows)
         
         headers = list(df.columns.astype(str))
         # 转换为字符串列表
@@ -111,8 +238,23 @@ def load_excel(path: str):
         sys.exit(1)
 
 
-def load_csv(path: str):
-    """Load CSV/Excel and return (headers, rows, delimiter) with robust validation."""
+def load_csv(path, suffix: str = ".csv", max_rows=None):
+    """Load CSV/Excel and return (headers, rows, delimiter) with robust validation.
+
+    path may be a file path, raw bytes, or a binary file-like object. For the
+    in-memory forms, suffix selects the loader (e.g. ".xlsx" for Excel).
+    With max_rows, reading stops after that many (non-empty) data rows.
+    """
+    if isinstance(path, (bytes, bytearray, memoryview)) or hasattr(path, "read"):
+        raw = bytes(path) if not hasattr(path, "read") else path.read()
+        if not raw:
+            print("❌ 文件为空")
+            sys.exit(1)
+        if suffix.lower() in (".xlsx", ".xls"):
+            return load_excel(io.BytesIO(raw), suffix=suffix, max_rows=max_rows)
+        logger.info("Loading CSV from memory (%.1f KB)", len(raw) / 1024)
+        return _parse_csv_bytes(raw, max_rows)
+
     p = Path(path)
     if not p.exists():
         print(f"❌ 文件不存在: {path}")
@@ -126,76 +268,179 @@ def load_csv(path: str):
     
     # Excel 文件使用专门的加载器
     if p.suffix.lower() in (".xlsx", ".xls"):
-        return load_excel(path)
+        return load_excel(path, max_rows=max_rows)
     
     if p.suffix.lower() not in (".csv", ".tsv", ".txt"):
         print(f"⚠️  文件类型 {p.suffix} 可能不是 CSV，尝试加载中...")
 
     logger.info("Loading CSV: %s (%.1f KB)", path, p.stat().st_size / 1024)
+    with open(p, "rb") as f:
+        return _parse_csv_stream(f, max_rows)
+
+
+def _sniff_encoding(sample: bytes, final: bool):
+    """Return (index in CSV_ENCODINGS, decoded text) for the first encoding
+    that decodes sample, the leading bytes of a file (latin-1 always does)."""
+    # A UTF-8 BOM settles it: utf-8-sig, which also keeps the BOM out of the
+    # first header (plain utf-8 would decode it as "\ufeff")
+    start = CSV_ENCODINGS.index("utf-8-sig") if sample.startswith(codecs.BOM_UTF8) else 0
+    for i, enc in enumerate(CSV_ENCODINGS[start:], start):
+        try:
+            # Incremental, so a multi-byte character cut off at the end of
+            # the sample is not mistaken for an invalid one
+            return i, codecs.getincrementaldecoder(enc)().decode(sample, final)
+        except UnicodeDecodeError:
+            continue
+    return len(CSV_ENCODINGS) - 1, sample.decode("latin-1")
+
+
+def _detect_delimiter(text: str) -> str:
+    """Pick the CSV_DELIMITERS candidate that occurs most often in the header
+    line of text, falling back to the whole sample and then to ",".
+
+    A plain str.count per candidate replaces csv.Sniffer, which is slow and
+    easily thrown off by quoted fields.
+    """
+    header = text.partition("\n")[0]
+    for scope in (header, text):
+        # max() keeps the first of equal counts, so ties go to ","
+        delimiter = max(CSV_DELIMITERS, key=scope.count)
+        if delimiter in scope:
+            return delimiter
+    return ","
+
 
-    # Detect encoding
-    encodings = ["utf-8", "utf-8-sig", "gbk", "gb2312", "latin-1"]
-    raw = p.read_bytes()
-    text = None
+def _parse_csv_bytes(raw: bytes, max_rows=None):
+    """Decode raw CSV bytes and return (headers, rows, delimiter)."""
+    return _parse_csv_stream(io.BytesIO(raw), max_rows)
+
+
+def _parse_csv_stream(f, max_rows=None):
+    """Parse a seekable binary CSV stream and return (headers, rows, delimiter).
+
+    Rows are decoded and parsed straight off the stream, so the decoded text
+    of the whole file is never held in memory next to the parsed rows. With
+    max_rows, the rest of the stream after that many data rows is not read.
+    """
+    sample = f.read(ENCODING_SAMPLE_BYTES)
+    start, text = _sniff_encoding(sample, final=len(sample) < ENCODING_SAMPLE_BYTES)
+
+    delimiter = _detect_delimiter(text)
+
+    # Only a file that goes bad after the sample is read more than once
+    rows = None
     used_encoding = None
-    for enc in encodings:
+    for enc in CSV_ENCODINGS[start:]:
+        f.seek(0)
+        stream = io.TextIOWrapper(f, encoding=enc, newline="")
         try:
-            text = raw.decode(enc)
+            # Filter out completely empty rows while reading; a non-blank first
+            # cell settles most rows without building a generator per row
+            reader = csv.reader(stream, delimiter=delimiter)
+            kept = (r for r in reader if (r and r[0].strip()) or any(cell.strip() for cell in r))
+            if max_rows is not None:
+                kept = itertools.islice(kept, max_rows + 1)  # + the header row
+            with _gc_paused():
+                rows = list(kept)
             used_encoding = enc
             break
-        except (UnicodeDecodeError, LookupError):
+        except UnicodeDecodeError:
             continue
-    if text is None:
+        finally:
+            stream.detach()  # leave f open for the caller / next attempt
+    if rows is None:
         print("❌ 无法解码文件，请检查编码")
         sys.exit(1)
 
     logger.info("Detected encoding: %s", used_encoding)
 
-    # Detect delimiter
-    sniffer = csv.Sniffer()
-    try:
-        dialect = sniffer.sniff(text[:4096])
-        delimiter = dialect.delimiter
-    except csv.Error:
-        delimiter = "," if "," in text[:1024] else "\t"
-
-    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
-    rows = list(reader)
-
-    # Filter out completely empty rows
-    rows = [r for r in rows if any(cell.strip() for cell in r)]
-
     if len(rows) < 2:
         print("❌ CSV 文件至少需要表头 + 1行数据")
         sys.exit(1)
 
     headers = rows[0]
     data = rows[1:]
+    _dedupe_low_cardinality(data, len(headers))
     logger.info("Loaded %d rows, %d columns, delimiter=%r", len(data), len(headers), delimiter)
     return headers, data, delimiter
 
 
+def _dedupe_low_cardinality(data, n_cols):
+    """Make equal cells of low-cardinality columns share one str object.
+
+    csv.reader allocates a new str per cell, so a city or yes/no column holds
+    one copy of each value per row. Columns with few distinct values in the
+    first DEDUPE_SAMPLE_ROWS rows are rewritten in place to reuse the first
+    copy of each value, which frees the rest. High-cardinality columns (ids,
+    amounts) are left alone, as they have little to share.
+    """
+    sample = data[:DEDUPE_SAMPLE_ROWS]
+    limit = len(sample) * DEDUPE_MAX_UNIQUE
+    for col_idx in range(n_cols):
+        if len({row[col_idx] for row in sample if col_idx < len(row)}) > limit:
+            continue
+        pool = {}
+        setdefault = pool.setdefault
+        for row in data:
+            if col_idx < len(row):
+                cell = row[col_idx]
+                row[col_idx] = setdefault(cell, cell)
+
+
 def truncate(s, maxlen=MAX_CELL_LEN):
     """Truncate string to maxlen, adding '...' if needed."""
     s = str(s).strip()
     return s[:maxlen] + "..." if len(s) > maxlen else s
 
 
-def csv_to_markdown_table(headers, rows, max_rows=None):
+# Cell text that would break a markdown table row: "|" ends the cell, a line
+# break ends the row
+_MARKDOWN_CELL_ESCAPES = str.maketrans({"|": "\\|", "\n": " ", "\r": ""})
+
+
+@functools.lru_cache(maxsize=None)
+def _markdown_separator(n_cols):
+    """The |---|---| line under a markdown table header with n_cols columns."""
+    return "| " + " | ".join(["---"] * n_cols) + " |"
+
+
+def csv_to_markdown_table(headers, rows, max_rows=None, max_cell_len=MAX_CELL_LEN):
     """Convert CSV rows to markdown table string."""
     if max_rows:
         rows = rows[:max_rows]
-    lines = []
-    lines.append("| " + " | ".join(headers) + " |")
-    lines.append("| " + " | ".join(["---"] * len(headers)) + " |")
+    n = len(headers)
+    pad = [""] * n
+    header = " | ".join([str(h).translate(_MARKDOWN_CELL_ESCAPES) for h in headers])
+    lines = ["| " + header + " |", _markdown_separator(n)]
     for row in rows:
-        # Pad or truncate row to match header count
-        padded = row + [""] * (len(headers) - len(row))
-        padded = padded[:len(headers)]
-        lines.append("| " + " | ".join(truncate(c) for c in padded) + " |")
+        # Pad or truncate row to match header count (most rows already do)
+        if len(row) != n:
+            row = (list(row) + pad)[:n]
+        # truncate() inlined, as this runs once per cell; loaders give str
+        # cells, other sources (e.g. database rows) go through str() first.
+        # Cut before escaping, so the cut never splits an escape
+        try:
+            cells = [c.strip() for c in row]
+        except AttributeError:
+            cells = [str(c).strip() for c in row]
+        cells = [c if len(c) <= max_cell_len else c[:max_cell_len] + "..." for c in cells]
+        line = " | ".join(cells)
+        # Escaping is rare: only when the row holds more "|" than its separators
+        if line.count("|") != n - 1 or "\n" in line or "\r" in line:
+            line = " | ".join([c.translate(_MARKDOWN_CELL_ESCAPES) for c in cells])
+        lines.append("| " + line + " |")
     return "\n".join(lines)
 
 
+def _valid_day(m):
+    """Whether a _DATE_FORMAT_RES match names a real day (e.g. not 2024-02-30)."""
+    try:
+        datetime(int(m["Y"]), int(m["m"]), int(m["d"]))
+    except ValueError:
+        return False
+    return True
+
+
 def infer_column_types(headers, data):
     """Infer column types by sampling data. Returns dict of header→type."""
     types = {}
@@ -206,6 +451,7 @@ def infer_column_types(headers, data):
         dates = 0
         empties = 0
         pattern_counts = {k: 0 for k in PATTERNS}
+        date_formats = list(_DATE_FORMAT_RES)  # the last format that matched moves to the front
         total = sample_size
 
         for row in data[:sample_size]:
@@ -214,33 +460,42 @@ def infer_column_types(headers, data):
                 continue
             val = row[col_idx].strip()
 
-            # Try number
-            try:
-                float(val.replace(",", "").replace("%", "").replace("¥", "").replace("$", ""))
-                nums += 1
-                continue
-            except ValueError:
-                pass
+            # Try number. float() takes "-" only as a sign (leading or after an
+            # exponent, possibly with the stripped noise in between) and never
+            # "/" or "年", so date-like cells skip a raising float()
+            sep = _DATE_SEPARATOR_RE.search(val, 1)
+            first = val[0]
+            if (first in _NUMBER_START or not first.isascii()) and (
+                sep is None or val[sep.start() - 1] in "eE,%¥$"
+            ):
+                try:
+                    float(val.replace(",", "").replace("%", "").replace("¥", "").replace("$", ""))
+                    nums += 1
+                    continue
+                except ValueError:
+                    pass
 
-            # Try date
+            # Try date: every format starts with a digit field and contains
+            # "-", "/" or "年", so other cells are never matched
             is_date = False
-            for fmt in DATE_FORMATS:
-                try:
-                    datetime.strptime(val, fmt)
+            if val[0].isdigit() and sep:
+                for i, fmt_re in enumerate(date_formats):
+                    m = fmt_re.fullmatch(val)
+                    if m is None or not _valid_day(m):
+                        continue
                     dates += 1
                     is_date = True
+                    if i:
+                        date_formats.insert(0, date_formats.pop(i))
                     break
-                except ValueError:
-                    continue
 
             if is_date:
                 continue
 
             # Try advanced patterns
-            for pname, pat in PATTERNS.items():
-                if pat.match(val):
-                    pattern_counts[pname] += 1
-                    break
+            m = _PATTERN_RE.match(val)
+            if m:
+                pattern_counts[m.lastgroup] += 1
 
         non_empty = total - empties
         if non_empty == 0:
@@ -260,15 +515,31 @@ def infer_column_types(headers, data):
     return types
 
 
-def infer_advanced_types(headers, data):
+def transpose_columns(headers, data):
+    """Column-major copy of data: one list of stripped cells per header.
+
+    Rows shorter than the header are padded with "", so column scans need
+    no per-cell bounds check or strip.
+    """
+    return [
+        [row[col_idx].strip() if col_idx < len(row) else "" for row in data]
+        for col_idx in range(len(headers))
+    ]
+
+
+def infer_advanced_types(headers, data, columns=None):
     """Extended type inference with cardinality and uniqueness info."""
     types = infer_column_types(headers, data)
+    if columns is None:
+        columns = transpose_columns(headers, data)
     details = {}
 
-    for col_idx, h in enumerate(headers):
-        values = [row[col_idx].strip() for row in data if col_idx < len(row) and row[col_idx].strip()]
-        unique_count = len(set(values))
-        total = len(values)
+    for h, cells in zip(headers, columns):
+        # Hash the column directly and count blanks in C; no filtered copy
+        uniques = set(cells)
+        uniques.discard("")
+        unique_count = len(uniques)
+        total = len(cells) - cells.count("")
 
         detail = {
             "type": types[h],
@@ -282,8 +553,8 @@ def infer_advanced_types(headers, data):
 
         # For categorical (low cardinality text), list unique values
         if detail["cardinality"] == "low" and types[h] == "text" and unique_count <= 20:
-            from collections import Counter
-            counter = Counter(values)
+            counter = Counter(cells)
+            counter.pop("", None)
             detail["value_counts"] = dict(counter.most_common(10))
 
         details[h] = detail
@@ -291,89 +562,232 @@ def infer_advanced_types(headers, data):
     return types, details
 
 
-def compute_basic_stats(headers, data, col_types):
-    """Compute basic statistics for numeric columns."""
-    stats = {}
+def compute_basic_stats(headers, data, col_types, columns=None):
+    """Compute basic statistics for numeric columns.
+
+    columns is the output of parse_numeric_columns; pass it to reuse an
+    earlier parse instead of re-reading every row.
+    """
+    if columns is None:
+        columns = parse_numeric_columns(headers, data, col_types)
+    names = [h for h, (values, _) in columns.items() if len(values)]
+    summaries = _map_numeric_columns(summarize_numeric, [(columns[h][0],) for h in names])
+    return dict(zip(names, summaries))
+
+
+def _map_numeric_columns(fn, arg_tuples):
+    """[fn(*args) for args in arg_tuples], fanned out over threads when it pays.
+
+    The first argument of each call is a column's values. Threads are only
+    used when at least two columns are NumPy-sized: the NumPy kernels
+    (partition, sum, dot, comparisons) release the GIL, so those columns run
+    on separate cores. Pure-Python columns hold the GIL and stay serial.
+    """
+    big = sum(len(args[0]) >= NUMPY_MIN_VALUES for args in arg_tuples)
+    workers = min(STATS_MAX_WORKERS, big)
+    if workers < 2 or _numpy() is None:
+        return [fn(*args) for args in arg_tuples]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda args: fn(*args), arg_tuples))
+
+
+def parse_numeric_columns(headers, data, col_types, columns=None):
+    """Parse every numeric column once. Returns header→(values, row indexes).
+
+    Columns with at least NUMPY_MIN_VALUES values are stored as contiguous
+    float64 arrays when NumPy is installed, so stats, outlier masks and
+    charts all reduce over one buffer instead of re-parsing the rows.
+    """
+    np = _numpy()
+    parsed = {}
     for col_idx, h in enumerate(headers):
         if col_types.get(h) != "numeric":
             continue
-        values = []
-        for row in data:
-            if col_idx < len(row) and row[col_idx].strip():
-                try:
-                    values.append(float(row[col_idx].strip().replace(",", "").replace("%", "").replace("¥", "").replace("$", "")))
-                except ValueError:
-                    pass
-        if not values:
+        if columns is not None:
+            values, positions = _parse_numeric_cells(columns[col_idx])
+        else:
+            values, positions = _parse_numeric_column(data, col_idx)
+        if np is not None and len(values) >= NUMPY_MIN_VALUES:
+            values = np.asarray(values, dtype=np.float64)  # no copy if already parsed as one
+        parsed[h] = (values, positions)
+    return parsed
+
+
+def numeric_values(data, col_idx):
+    """Parse one column to floats, skipping empty and non-numeric cells.
+
+    Thousands separators, % and currency signs are stripped first.
+    """
+    values, _ = _parse_numeric_column(data, col_idx)
+    return values
+
+
+def _parse_numeric_column(data, col_idx):
+    """Return (values, row indexes) of the cells in col_idx that parse as numbers."""
+    return _parse_numeric_cells(
+        row[col_idx].strip() if col_idx < len(row) else "" for row in data
+    )
+
+
+def _parse_numeric_cells(cells):
+    """Return (values, indexes) of the stripped cells that parse as numbers.
+
+    The whole column first goes through map(float) at C speed; a column with
+    no empty cells gets a range() as its indexes. If any cell fails, the
+    column is re-parsed per cell, trying bare float() until the first cell
+    that needs the cleanup path (strip ",", "%", "¥", "$").
+
+    With NumPy, a column of at least NUMPY_MIN_VALUES values is parsed
+    straight into a float64 array, never holding a list of float objects.
+    """
+    cells = cells if isinstance(cells, list) else list(cells)
+    present = list(filter(None, cells))
+    np = _numpy() if len(present) >= NUMPY_MIN_VALUES else None
+    try:
+        if np is not None:
+            values = np.fromiter(map(float, present), dtype=np.float64, count=len(present))
+        else:
+            values = list(map(float, present))
+    except ValueError:
+        pass
+    else:
+        if len(present) == len(cells):
+            return values, range(len(cells))
+        return values, [row_idx for row_idx, cell in enumerate(cells) if cell]
+
+    values = []
+    positions = []
+    noisy = False
+    for row_idx, cell in enumerate(cells):
+        if not cell or (cell[0] not in _NUMBER_START and cell[0].isascii()):
             continue
-        values.sort()
-        n = len(values)
-        mean = sum(values) / n
+        if not noisy:
+            try:
+                values.append(float(cell))
+                positions.append(row_idx)
+                continue
+            except ValueError:
+                noisy = True
+        try:
+            values.append(float(cell.replace(",", "").replace("%", "").replace("¥", "").replace("$", "")))
+            positions.append(row_idx)
+        except ValueError:
+            pass
+    return values, positions
+
+
+def summarize_numeric(values):
+    """Summary statistics for a non-empty sequence of floats.
+
+    Quartiles and median are order statistics (sorted[n//4], sorted[n//2],
+    sorted[3n//4]). Large columns use NumPy when it is installed: a single
+    np.partition selects all order statistics in O(n) instead of a full sort.
+    """
+    n = len(values)
+    np = _numpy() if n >= NUMPY_MIN_VALUES else None
+    if np is not None:
+        arr = np.asarray(values, dtype=np.float64)
+        kth = (0, n // 4, n // 2, (3 * n) // 4, n - 1)
+        part = np.partition(arr, kth)
+        vmin, q1, median, q3, vmax = (float(part[k]) for k in kth)
+        total = float(arr.sum())
+        mean = total / n
+        dev = arr - mean
+        variance = float(dev @ dev) / max(n - 1, 1)  # one temporary, BLAS dot
+    else:
+        values = sorted(values)
+        vmin, vmax = values[0], values[-1]
+        q1, median, q3 = values[n // 4], values[n // 2], values[(3 * n) // 4]
+        total = sum(values)
+        mean = total / n
         variance = sum((v - mean) ** 2 for v in values) / max(n - 1, 1)
-        std_dev = math.sqrt(variance)
-        q1 = values[n // 4] if n >= 4 else values[0]
-        q3 = values[(3 * n) // 4] if n >= 4 else values[-1]
-        iqr = q3 - q1
-
-        stats[h] = {
-            "count": n,
-            "min": round(values[0], 4),
-            "max": round(values[-1], 4),
-            "mean": round(mean, 4),
-            "median": round(values[n // 2], 4),
-            "sum": round(sum(values), 4),
-            "std_dev": round(std_dev, 4),
-            "q1": round(q1, 4),
-            "q3": round(q3, 4),
-            "iqr": round(iqr, 4),
-        }
-    return stats
 
+    return {
+        "count": n,
+        "min": round(vmin, 4),
+        "max": round(vmax, 4),
+        "mean": round(mean, 4),
+        "median": round(median, 4),
+        "sum": round(total, 4),
+        "std_dev": round(math.sqrt(variance), 4),
+        "q1": round(q1, 4),
+        "q3": round(q3, 4),
+        "iqr": round(q3 - q1, 4),
+    }
 
-def detect_outliers(headers, data, col_types, stats=None):
+
+def detect_outliers(headers, data, col_types, stats=None, columns=None):
     """Detect outliers using IQR method. Returns dict of header→outlier_info."""
+    if columns is None:
+        columns = parse_numeric_columns(headers, data, col_types)
     if stats is None:
-        stats = compute_basic_stats(headers, data, col_types)
+        stats = compute_basic_stats(headers, data, col_types, columns)
 
-    outliers = {}
-    for col_idx, h in enumerate(headers):
+    bounds = {}
+    for h in columns:
         if h not in stats or stats[h]["iqr"] == 0:
             continue
-
         s = stats[h]
         q1, q3, iqr = s["q1"], s["q3"], s["iqr"]
-        lower_bound = q1 - 1.5 * iqr
-        upper_bound = q3 + 1.5 * iqr
+        bounds[h] = (q1 - 1.5 * iqr, q3 + 1.5 * iqr)
 
-        outlier_values = []
-        outlier_rows = []
-        for row_idx, row in enumerate(data):
-            if col_idx < len(row) and row[col_idx].strip():
-                try:
-                    v = float(row[col_idx].strip().replace(",", "").replace("%", "").replace("¥", "").replace("$", ""))
-                    if v < lower_bound or v > upper_bound:
-                        outlier_values.append(v)
-                        outlier_rows.append(row_idx + 2)  # +2 for header + 1-indexed
-                except ValueError:
-                    pass
+    found = _map_numeric_columns(find_outliers, [(*columns[h], *bounds[h]) for h in bounds])
 
-        if outlier_values:
+    outliers = {}
+    for h, (count, outlier_values, outlier_rows) in zip(bounds, found):
+        if count:
+            s = stats[h]
+            lower_bound, upper_bound = bounds[h]
             outliers[h] = {
-                "count": len(outlier_values),
-                "percentage": round(len(outlier_values) / s["count"] * 100, 1),
+                "count": count,
+                "percentage": round(count / s["count"] * 100, 1),
                 "lower_bound": round(lower_bound, 4),
                 "upper_bound": round(upper_bound, 4),
-                "values": outlier_values[:10],  # first 10
-                "rows": outlier_rows[:10],
+                "values": outlier_values,  # first 10
+                "rows": outlier_rows,
             }
 
     return outliers
 
 
-def compute_data_quality_score(headers, data, col_types, type_details=None):
+def find_outliers(values, positions, lower_bound, upper_bound, limit=10):
+    """Return (count, first `limit` outlier values, their CSV line numbers).
+
+    positions are 0-based data row indices; line numbers add 2 for the
+    header and 1-indexing. Large columns use a vectorized NumPy mask.
+    """
+    np = _numpy() if len(values) >= NUMPY_MIN_VALUES else None
+    if np is not None:
+        arr = np.asarray(values, dtype=np.float64)
+        idx = np.flatnonzero((arr < lower_bound) | (arr > upper_bound))
+        head = idx[:limit]
+        return (
+            int(idx.size),
+            arr[head].tolist(),
+            [positions[i] + 2 for i in head.tolist()],
+        )
+
+    count = 0
+    outlier_values = []
+    outlier_rows = []
+    for v, pos in zip(values, positions):
+        if v < lower_bound or v > upper_bound:
+            count += 1
+            if count <= limit:
+                outlier_values.append(v)
+                outlier_rows.append(pos + 2)
+    return count, outlier_values, outlier_rows
+
+
+def compute_data_quality_score(headers, data, col_types, type_details=None, columns=None):
     """Compute an overall data quality score (0-100)."""
     if type_details is None:
         _, type_details = infer_advanced_types(headers, data)
+    if columns is None:
+        columns = parse_numeric_columns(headers, data, col_types)
 
     scores = {
         "completeness": 100,
@@ -388,20 +802,13 @@ def compute_data_quality_score(headers, data, col_types, type_details=None):
         scores["completeness"] = round((1 - empty_cells / total_cells) * 100, 1)
 
     # Consistency: check if columns have consistent types
+    # (non-empty cells come from type_details; only the parse count is new work)
     inconsistent = 0
-    for col_idx, h in enumerate(headers):
-        if col_types.get(h) == "numeric":
-            non_numeric = 0
-            total = 0
-            for row in data:
-                if col_idx < len(row) and row[col_idx].strip():
-                    total += 1
-                    try:
-                        float(row[col_idx].strip().replace(",", "").replace("%", "").replace("¥", "").replace("$", ""))
-                    except ValueError:
-                        non_numeric += 1
-            if total > 0 and non_numeric / total > 0.1:
-                inconsistent += 1
+    for h, (values, _) in columns.items():
+        total = type_details[h]["non_empty"]
+        non_numeric = total - len(values)
+        if total > 0 and non_numeric / total > 0.1:
+            inconsistent += 1
     if headers:
         scores["consistency"] = round((1 - inconsistent / len(headers)) * 100, 1)
 
@@ -444,9 +851,8 @@ def suggest_visualizations(headers, col_types, stats, data):
 
     # Category comparison
     if text_cols and numeric_cols:
-        unique_count = len(set(row[headers.index(text_cols[0])]
-                              for row in data[:100]
-                              if headers.index(text_cols[0]) < len(row)))
+        col_idx = headers.index(text_cols[0])
+        unique_count = len(set(row[col_idx] for row in data[:100] if col_idx < len(row)))
         if unique_count <= 15:
             suggestions.append({
                 "type": "柱状图 (Bar Chart)",
@@ -498,24 +904,111 @@ def suggest_visualizations(headers, col_types, stats, data):
     return suggestions
 
 
-def build_schema_prompt(headers, data, col_types):
-    """Build a schema description for the LLM."""
-    lines = ["## 数据集概要", f"- 总行数: {len(data)}", f"- 列数: {len(headers)}", ""]
+def build_schema_prompt(headers, data, col_types, truncated=False):
+    """Build a schema description for the LLM (truncated: data is only the
+    first rows of a longer file)."""
+    n_rows = f"超过 {len(data)}（只读取了前 {len(data)} 行）" if truncated else len(data)
+    lines = ["## 数据集概要", f"- 总行数: {n_rows}", f"- 列数: {len(headers)}", ""]
     lines.append("## 列信息")
     for col_idx, h in enumerate(headers):
         t = col_types.get(h, "unknown")
-        # Get sample unique values
-        vals = set()
+        # Get sample unique values, in order of first appearance (a set's
+        # order changes with the hash seed, and so would the prompt)
+        vals = {}
         for row in data[:100]:
             if col_idx < len(row) and row[col_idx].strip():
-                vals.add(truncate(row[col_idx], 50))
-            if len(vals) >= 5:
-                break
-        sample = ", ".join(list(vals)[:5])
+                vals[truncate(row[col_idx], 50)] = None
+                if len(vals) >= 5:
+                    break
+        sample = ", ".join(vals)
         lines.append(f"- **{h}** (类型: {t}) — 示例值: {sample}")
     return "\n".join(lines)
 
 
+# ---------------------------------------------------------------------------
+# Analytics cache — type/stats/outlier/quality results per input file
+# ---------------------------------------------------------------------------
+
+ANALYTICS_FIELDS = ("col_types", "type_details", "stats", "outliers", "quality")
+
+
+def analytics_cache_file(path, scan_rows=None):
+    """Cache file for one input file's analytics.
+
+    Keyed by csvwise version, absolute path, mtime, size and the first 64 KB,
+    so an edited or replaced file never reuses stale results; scan_rows keeps
+    sampled analytics apart from whole-file ones.
+    """
+    p = Path(path).resolve()
+    st = p.stat()
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{VERSION}\0{p}\0{st.st_mtime_ns}\0{st.st_size}\0".encode("utf-8", "surrogateescape"))
+    if scan_rows is not None:
+        h.update(f"scan={scan_rows}\0".encode("ascii"))
+    with open(p, "rb") as f:
+        h.update(f.read(65536))
+    return ANALYTICS_CACHE_DIR / f"{h.hexdigest()}.json"
+
+
+def read_analytics_cache(cache_file):
+    """Return the cached analytics dict (only ANALYTICS_FIELDS), or {} on a miss."""
+    try:
+        raw = cache_file.read_bytes()
+    except OSError:
+        return {}
+    orjson = _orjson()
+    try:
+        cached = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError:
+        # orjson rejects the NaN/Infinity tokens json.dumps writes for
+        # non-finite stats; the stdlib parser reads them back
+        try:
+            cached = json.loads(raw)
+        except ValueError:
+            return {}
+    if not isinstance(cached, dict):
+        return {}
+    with contextlib.suppress(OSError):
+        os.utime(cache_file)  # mtime marks last use for trim_analytics_cache
+    return {k: v for k, v in cached.items() if k in ANALYTICS_FIELDS}
+
+
+def write_analytics_cache(cache_file, entries):
+    """Write the analytics dict atomically (temp file + rename)."""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        logger.warning("Failed to write analytics cache %s: %s", cache_file, e)
+    else:
+        trim_analytics_cache()
+
+
+@functools.lru_cache(maxsize=None)
+def trim_analytics_cache():
+    """Delete analytics files unused for ANALYTICS_CACHE_TTL, then the least
+    recently used ones until the rest fit ANALYTICS_CACHE_MAX_BYTES.
+
+    Runs once per process, on the first cache write.
+    """
+    try:
+        files = [(e.stat().st_mtime, e.stat().st_size, e.path)
+                 for e in os.scandir(ANALYTICS_CACHE_DIR) if e.name.endswith(".json")]
+    except OSError:
+        return
+    files.sort()
+    expired = time.time() - ANALYTICS_CACHE_TTL
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if mtime >= expired and total <= ANALYTICS_CACHE_MAX_BYTES:
+            break
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        total -= size
+
+
 # ---------------------------------------------------------------------------
 # DataContext — eliminates repeated loading boilerplate
 # ---------------------------------------------------------------------------
@@ -523,67 +1016,124 @@ def build_schema_prompt(headers, data, col_types):
 class DataContext:
     """Holds loaded CSV data with lazy-computed analytics."""
 
-    def __init__(self, path: str):
-        self.path = path
-        self.headers, self.data, self.delimiter = load_csv(path)
-        self._col_types = None
-        self._type_details = None
-        self._stats = None
-        self._outliers = None
-        self._quality = None
-        self._viz_suggestions = None
-        self._schema_prompt = None
-
-    @property
+    def __init__(self, path=None, suffix: str = ".csv", headers=None, rows=None,
+                 scan_rows=None, max_rows=None):
+        """Load from path (or bytes / a binary buffer, see load_csv), or take
+        already-parsed headers and rows (e.g. a database table) without re-parsing.
+
+        Pre-parsed cells are converted to strings the way csv.writer would
+        write them (None becomes ""), so analytics behave as for a loaded CSV.
+
+        With scan_rows, analytics (types, stats, outliers, quality) only look
+        at the first scan_rows data rows; self.scan_rows is None when the
+        data fits anyway.
+
+        With max_rows, only the first max_rows data rows of a file are loaded
+        at all (for commands that need the schema, not the full data);
+        self.truncated tells whether the file has more. Analytics of a
+        truncated load are those of scan_rows=max_rows and share its cache.
+        """
+        if rows is not None:
+            self.path = None
+            self.headers = [str(h) for h in headers]
+            with _gc_paused():
+                self.data = [["" if v is None else str(v) for v in row] for row in rows]
+            self.delimiter = ","
+        else:
+            self.path = path if isinstance(path, (str, os.PathLike)) else None
+            self.headers, self.data, self.delimiter = load_csv(
+                path, suffix=suffix, max_rows=None if max_rows is None else max_rows + 1
+            )
+        self.truncated = max_rows is not None and len(self.data) > max_rows
+        if self.truncated:
+            del self.data[max_rows:]
+            self.scan_rows = max_rows
+            self.scan_data = self.data
+        elif scan_rows is not None and len(self.data) > scan_rows:
+            self.scan_rows = scan_rows
+            self.scan_data = self.data[:scan_rows]
+        else:
+            self.scan_rows = None
+            self.scan_data = self.data
+        self._sample_tables = {}
+        self._numeric_arrays = {}
+
+        # File inputs reuse analytics from earlier runs when the cache is on
+        self._cache_file = None
+        self._cache_entries = {}
+        if ANALYTICS_CACHE_ENABLED and self.path is not None:
+            try:
+                self._cache_file = analytics_cache_file(self.path, self.scan_rows)
+            except OSError:
+                pass
+            else:
+                self._cache_entries = read_analytics_cache(self._cache_file)
+                self.__dict__.update(self._cache_entries)
+                if self._cache_entries:
+                    logger.info("Analytics cache hit: %s", self._cache_file)
+
+    def _store(self, name, value):
+        """Record a computed analytics result in the on-disk cache (if any)."""
+        if self._cache_file is not None:
+            self._cache_entries[name] = value
+            write_analytics_cache(self._cache_file, self._cache_entries)
+        return value
+
+    # Analytics are computed on first access and cached on the instance;
+    # a context is never mutated after loading, so nothing needs invalidation.
+
+    @functools.cached_property
     def col_types(self):
-        if self._col_types is None:
-            self._col_types = infer_column_types(self.headers, self.data)
-        return self._col_types
+        return self._store("col_types", infer_column_types(self.headers, self.scan_data))
 
-    @property
+    @functools.cached_property
+    def columns(self):
+        """Column-major view of scan_data (stripped cells, short rows padded)."""
+        return transpose_columns(self.headers, self.scan_data)
+
+    @functools.cached_property
     def type_details(self):
-        if self._type_details is None:
-            self._col_types, self._type_details = infer_advanced_types(self.headers, self.data)
-        return self._type_details
+        col_types, details = infer_advanced_types(self.headers, self.scan_data, self.columns)
+        if "col_types" not in self.__dict__:
+            self.col_types = self._store("col_types", col_types)
+        return self._store("type_details", details)
+
+    @functools.cached_property
+    def _numeric_columns(self):
+        return parse_numeric_columns(self.headers, self.scan_data, self.col_types, self.columns)
 
-    @property
+    @functools.cached_property
     def stats(self):
-        if self._stats is None:
-            self._stats = compute_basic_stats(self.headers, self.data, self.col_types)
-        return self._stats
+        return self._store("stats", compute_basic_stats(
+            self.headers, self.scan_data, self.col_types, self._numeric_columns
+        ))
 
-    @property
+    @functools.cached_property
     def outliers(self):
-        if self._outliers is None:
-            self._outliers = detect_outliers(self.headers, self.data, self.col_types, self.stats)
-        return self._outliers
+        return self._store("outliers", detect_outliers(
+            self.headers, self.scan_data, self.col_types, self.stats, self._numeric_columns
+        ))
+
+    @functools.cached_property
+    def outlier_count(self):
+        return sum(o["count"] for o in self.outliers.values())
 
-    @property
+    @functools.cached_property
     def quality(self):
-        if self._quality is None:
-            self._quality = compute_data_quality_score(
-                self.headers, self.data, self.col_types, self.type_details
-            )
-        return self._quality
+        return self._store("quality", compute_data_quality_score(
+            self.headers, self.scan_data, self.col_types, self.type_details, self._numeric_columns
+        ))
 
-    @property
+    @functools.cached_property
     def viz_suggestions(self):
-        if self._viz_suggestions is None:
-            self._viz_suggestions = suggest_visualizations(
-                self.headers, self.col_types, self.stats, self.data
-            )
-        return self._viz_suggestions
+        return suggest_visualizations(self.headers, self.col_types, self.stats, self.scan_data)
 
-    @property
+    @functools.cached_property
     def schema_prompt(self):
-        if self._schema_prompt is None:
-            self._schema_prompt = build_schema_prompt(
-                self.headers, self.data, self.col_types
-            )
-        return self._schema_prompt
+        return build_schema_prompt(self.headers, self.data, self.col_types, self.truncated)
 
-    def stats_text(self):
-        """Format stats as text section for prompts."""
+    @functools.cached_property
+    def _stats_text(self):
         if not self.stats:
             return ""
         lines = ["## 基础统计"]
@@ -595,10 +1145,76 @@ class DataContext:
             )
         return "\n".join(lines)
 
+    def stats_text(self):
+        """Format stats as text section for prompts."""
+        return self._stats_text
+
     def sample_table(self, max_rows=None):
         """Get markdown table of sample data."""
         n = max_rows or min(MAX_ANALYSIS_ROWS, len(self.data))
-        return csv_to_markdown_table(self.headers, self.data, max_rows=n)
+        if n not in self._sample_tables:
+            self._sample_tables[n] = csv_to_markdown_table(self.headers, self.data, max_rows=n)
+        return self._sample_tables[n]
+
+    def _numbers(self, column):
+        """(values, row indexes) of a column over all rows, reusing the
+        shared numeric parse unless analytics only scanned a sample."""
+        if self.scan_rows is not None:
+            return _parse_numeric_column(self.data, self.headers.index(column))
+        if column in self._numeric_columns:
+            return self._numeric_columns[column]
+        return _parse_numeric_cells(self.columns[self.headers.index(column)])
+
+    def smart_sample(self, n_rows=SMART_SAMPLE_ROWS, max_cell_len=SMART_SAMPLE_CELL_LEN):
+        """Markdown table of n_rows rows spread over the whole file: the first
+        and last third of n_rows plus evenly spaced rows in between, with
+        cells cut to max_cell_len. Cheaper in prompt tokens than a long head.
+        """
+        key = ("smart", n_rows, max_cell_len)
+        if key not in self._sample_tables:
+            n = len(self.data)
+            if n <= n_rows:
+                picked = range(n)
+            else:
+                k = n_rows // 3
+                m = n_rows - 2 * k
+                middle = [k + (n - 2 * k) * (2 * i + 1) // (2 * m) for i in range(m)]
+                picked = [*range(k), *middle, *range(n - k, n)]
+            self._sample_tables[key] = csv_to_markdown_table(
+                self.headers, [self.data[i] for i in picked], max_cell_len=max_cell_len
+            )
+        return self._sample_tables[key]
+
+    def numeric_array(self, column):
+        """Parsed values of a column (empty / non-numeric cells dropped).
+
+        A float64 NumPy array when NumPy is installed, else a list of floats;
+        either can go straight to matplotlib without a pandas round trip.
+        """
+        if column not in self._numeric_arrays:
+            values, _ = self._numbers(column)
+            np = _numpy()
+            self._numeric_arrays[column] = (
+                np.asarray(values, dtype=np.float64) if np is not None else values
+            )
+        return self._numeric_arrays[column]
+
+    def numeric_column(self, column):
+        """A column parsed as numbers and aligned with the data rows.
+
+        Empty and non-numeric cells become NaN. Returns a float64 array when
+        NumPy is installed, else a list; reuses the shared numeric parse.
+        """
+        values, positions = self._numbers(column)
+        np = _numpy()
+        if np is None:
+            out = [math.nan] * len(self.data)
+            for pos, v in zip(positions, values):
+                out[pos] = v
+            return out
+        out = np.full(len(self.data), np.nan)
+        out[positions] = values
+        return out
 
     def outliers_text(self):
         """Format outlier info as text section."""
@@ -630,14 +1246,178 @@ class DataContext:
 # LLM Integration
 # ---------------------------------------------------------------------------
 
+_LLM_CACHE_LOCK = threading.Lock()
+
+
+def _llm_cache():
+    """The persistent LLM cache connection (opened once per process); None if unavailable."""
+    # lru_cache does not serialize its first call: without the lock, worker
+    # threads of llm_query_many could each open the file and create tables
+    with _LLM_CACHE_LOCK:
+        return _open_llm_cache()
+
+
+@functools.lru_cache(maxsize=None)
+def _open_llm_cache():
+    """Open the persistent LLM cache; call through _llm_cache()."""
+    import sqlite3  # only commands that call the LLM pay for this import
+
+    try:
+        LLM_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(LLM_CACHE_FILE, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key BLOB PRIMARY KEY, response TEXT NOT NULL, ts INTEGER NOT NULL DEFAULT 0, "
+            "used INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Answers by normalized question, per prompt context (the prompt minus
+        # the question), so a rephrased question reuses its answer
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_questions ("
+            "context BLOB NOT NULL, question TEXT NOT NULL, response TEXT NOT NULL, "
+            "ts INTEGER NOT NULL, used INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (context, question))"
+        )
+        # Caches from older versions: rows without a timestamp count as expired,
+        # rows without a last-use time are evicted first
+        for table in ("llm_cache", "llm_questions"):
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column in ("ts", "used"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+        expired = int(time.time()) - LLM_CACHE_TTL
+        conn.execute("DELETE FROM llm_cache WHERE ts < ?", (expired,))
+        conn.execute("DELETE FROM llm_questions WHERE ts < ?", (expired,))
+        _trim_llm_cache(conn)
+        conn.commit()
+        return conn
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("LLM cache unavailable: %s", e)
+        return None
+
+
+def _trim_llm_cache(conn):
+    """Delete the least recently used responses (both tables) until the rest
+    fit LLM_CACHE_MAX_BYTES."""
+    rows = conn.execute(
+        "SELECT 'llm_cache', rowid, used, LENGTH(CAST(response AS BLOB)) FROM llm_cache "
+        "UNION ALL "
+        "SELECT 'llm_questions', rowid, used, LENGTH(CAST(response AS BLOB)) FROM llm_questions "
+        "ORDER BY used"
+    ).fetchall()
+    total = sum(row[3] for row in rows)
+    for table, rowid, _, size in rows:
+        if total <= LLM_CACHE_MAX_BYTES:
+            break
+        conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+        total -= size
+
+
+def _llm_cache_key(prompt: str) -> bytes:
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+
+
+def llm_cache_get(prompt: str):
+    """Return the cached response for prompt, or None (also once older than LLM_CACHE_TTL)."""
+    conn = _llm_cache() if LLM_CACHE_ENABLED else None
+    if conn is None:
+        return None
+    key, now = _llm_cache_key(prompt), int(time.time())
+    with _LLM_CACHE_LOCK:
+        row = conn.execute(
+            "SELECT response FROM llm_cache WHERE key = ? AND ts >= ?",
+            (key, now - LLM_CACHE_TTL),
+        ).fetchone()
+        if row:
+            conn.execute("UPDATE llm_cache SET used = ? WHERE key = ?", (now, key))
+            conn.commit()
+    return row[0] if row else None
+
+
+def llm_cache_put(prompt: str, response: str):
+    """Store a successful response; error messages (❌ ...) are never cached."""
+    conn = _llm_cache() if LLM_CACHE_ENABLED else None
+    if conn is None or not response or response.startswith("❌"):
+        return
+    now = int(time.time())
+    with _LLM_CACHE_LOCK:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response, ts, used) VALUES (?, ?, ?, ?)",
+            (_llm_cache_key(prompt), response, now, now),
+        )
+        conn.commit()
+
+
+def llm_cache_get_question(context: str, question: str):
+    """Return the cached response to question asked with the same prompt
+    context, or None. Questions match only after normalize_question, never
+    by similarity (see find_cached_question)."""
+    conn = _llm_cache() if LLM_CACHE_ENABLED else None
+    if conn is None:
+        return None
+    key, question, now = _llm_cache_key(context), normalize_question(question), int(time.time())
+    with _LLM_CACHE_LOCK:
+        row = conn.execute(
+            "SELECT response FROM llm_questions WHERE context = ? AND question = ? AND ts >= ?",
+            (key, question, now - LLM_CACHE_TTL),
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE llm_questions SET used = ? WHERE context = ? AND question = ?", (now, key, question)
+            )
+            conn.commit()
+    return row[0] if row else None
+
+
+def llm_cache_put_question(context: str, question: str, response: str):
+    """Store a successful response under its context and normalized question."""
+    conn = _llm_cache() if LLM_CACHE_ENABLED else None
+    if conn is None or not response or response.startswith("❌"):
+        return
+    now = int(time.time())
+    with _LLM_CACHE_LOCK:
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_questions (context, question, response, ts, used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (_llm_cache_key(context), normalize_question(question), response, now, now),
+        )
+        conn.commit()
+
+
+_GEMINI_PATH = None
+
+
+def gemini_executable() -> str:
+    """Absolute path of the gemini CLI, resolved once per process.
+
+    Spawns then exec the binary directly instead of searching PATH on every
+    call. Until gemini is found the bare name is returned (so a missing CLI
+    still raises FileNotFoundError) and the lookup is retried next time.
+    """
+    global _GEMINI_PATH
+    if _GEMINI_PATH is None:
+        _GEMINI_PATH = shutil.which("gemini")
+    return _GEMINI_PATH or "gemini"
+
+
 def llm_query(prompt: str, timeout: int = LLM_TIMEOUT, retries: int = LLM_MAX_RETRIES) -> str:
+    """Call gemini CLI for LLM inference, served from the persistent cache when possible."""
+    cached = llm_cache_get(prompt)
+    if cached is not None:
+        logger.info("LLM cache hit (prompt length: %d chars)", len(prompt))
+        return cached
+    response = _llm_call(prompt, timeout, retries)
+    llm_cache_put(prompt, response)
+    return response
+
+
+def _llm_call(prompt: str, timeout: int = LLM_TIMEOUT, retries: int = LLM_MAX_RETRIES) -> str:
     """Call gemini CLI for LLM inference with retry logic."""
     last_error = ""
     for attempt in range(1, retries + 1):
         try:
             logger.info("LLM query attempt %d/%d (prompt length: %d chars)", attempt, retries, len(prompt))
             result = subprocess.run(
-                ["gemini", prompt],
+                [gemini_executable(), prompt],
                 capture_output=True,
                 text=True,
                 timeout=timeout,
@@ -648,7 +1428,7 @@ def llm_query(prompt: str, timeout: int = LLM_TIMEOUT, retries: int = LLM_MAX_RE
 
             # Fallback: try with stdin
             result2 = subprocess.run(
-                ["gemini"],
+                [gemini_executable()],
                 input=prompt,
                 capture_output=True,
                 text=True,
@@ -675,26 +1455,356 @@ def llm_query(prompt: str, timeout: int = LLM_TIMEOUT, retries: int = LLM_MAX_RE
     return f"❌ LLM 调用失败 (重试{retries}次): {last_error}"
 
 
+class LLMStreamError(RuntimeError):
+    """The gemini CLI failed (non-zero exit or timeout) after part of its
+    answer was already streamed; the text yielded so far is incomplete."""
+
+
+def llm_query_stream(prompt: str, timeout: int = LLM_TIMEOUT):
+    """Yield the gemini CLI response line by line as it is produced.
+
+    Falls back to the buffered llm_query (with its retries) when the
+    streamed call fails before producing any output. Cached responses are
+    yielded whole; complete streamed responses are stored in the cache.
+    A call that fails after yielding output raises LLMStreamError at the
+    end, so callers never mistake a cut-off answer for a complete one.
+    """
+    cached = llm_cache_get(prompt)
+    if cached is not None:
+        logger.info("LLM cache hit (prompt length: %d chars)", len(prompt))
+        yield cached
+        return
+
+    try:
+        proc = subprocess.Popen(
+            [gemini_executable(), prompt],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+    except FileNotFoundError:
+        yield "❌ 未找到 gemini CLI。请安装: npm i -g @anthropic-ai/gemini-cli"
+        return
+
+    logger.info("LLM stream started (prompt length: %d chars)", len(prompt))
+    # Drain stderr alongside stdout: a CLI that writes more than a pipe
+    # buffer of warnings would otherwise block until the timeout kill
+    stderr_tail = deque(maxlen=20)
+    drain = threading.Thread(target=stderr_tail.extend, args=(proc.stderr,), daemon=True)
+    drain.start()
+    killer = threading.Timer(timeout, proc.kill)
+    killer.start()
+    produced = False
+    chunks = []
+    try:
+        for line in proc.stdout:
+            if line.strip() or produced:
+                produced = True
+                chunks.append(line)
+                yield line
+        proc.wait()
+    finally:
+        killer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        drain.join(timeout=1)
+        proc.stdout.close()
+        if not drain.is_alive():
+            proc.stderr.close()
+
+    if proc.returncode and stderr_tail:
+        logger.warning("LLM stream exited with %s: %s", proc.returncode, "".join(stderr_tail).strip())
+    if not produced:
+        logger.warning("LLM stream returned no output (exit %s), falling back", proc.returncode)
+        yield llm_query(prompt, timeout=timeout)
+    elif proc.returncode == 0:
+        llm_cache_put(prompt, "".join(chunks).strip())
+    else:
+        raise LLMStreamError(f"gemini CLI 异常退出 (退出码 {proc.returncode})，回答不完整")
+
+
+def llm_print(prompt: str, timeout: int = LLM_TIMEOUT) -> str:
+    """Stream the LLM response to stdout as it arrives; return the full text.
+
+    If the stream breaks off (LLMStreamError), an error line is printed and
+    the returned text is that error (starting with ❌), so it is never
+    cached as an answer.
+    """
+    chunks = []
+    try:
+        for chunk in llm_query_stream(prompt, timeout=timeout):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+            chunks.append(chunk)
+    except LLMStreamError as e:
+        error = f"❌ {e}"
+        if chunks and not chunks[-1].endswith("\n"):
+            sys.stdout.write("\n")
+        print(error)
+        return error
+    if chunks and not chunks[-1].endswith("\n"):
+        sys.stdout.write("\n")
+    return "".join(chunks).strip()
+
+
+def llm_query_many(prompts, timeout: int = LLM_TIMEOUT, max_workers: int = LLM_MAX_WORKERS):
+    """Run several LLM queries concurrently. Results keep the order of prompts."""
+    prompts = list(prompts)
+    if len(prompts) <= 1:
+        return [llm_query(p, timeout=timeout) for p in prompts]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    logger.info("Dispatching %d LLM queries (max_workers=%d)", len(prompts), max_workers)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(prompts))) as pool:
+        # Submit everything before collecting, so the calls overlap
+        futures = [pool.submit(llm_query, p, timeout) for p in prompts]
+        return [f.result() for f in futures]
+
+
+def extract_code(text: str) -> str:
+    """Code from an LLM reply: the first ```python block, else the first
+    fenced block (minus its language tag), else the whole text; stripped."""
+    m = _PYTHON_BLOCK_RE.search(text) or _CODE_BLOCK_RE.search(text)
+    return (m.group(1) if m else text).strip()
+
+
+def llm_ask_many(head: str, tail: str, questions, timeout: int = LLM_TIMEOUT):
+    """Answer several questions that share one prompt (head + question + tail).
+
+    Answers already cached for this context under the same normalized
+    question are reused. The rest go out LLM_BATCH_SIZE at a time as one batched prompt each, the
+    batches running concurrently; a question the batched reply skipped is
+    then asked on its own. Returns the answers in order of questions.
+    """
+    context = head + tail
+    answers = [llm_cache_get_question(context, q) for q in questions]
+    pending = [i for i, a in enumerate(answers) if a is None]
+    batches = [pending[i:i + LLM_BATCH_SIZE] for i in range(0, len(pending), LLM_BATCH_SIZE)]
+    prompts = [
+        head + (build_batch_question([questions[i] for i in batch]) if len(batch) > 1
+                else questions[batch[0]]) + tail
+        for batch in batches
+    ]
+    for batch, text in zip(batches, llm_query_many(prompts, timeout=timeout)):
+        if len(batch) == 1 or text.startswith("❌"):
+            parts = [text] * len(batch)
+        else:
+            parts = split_batch_answers(text, len(batch))
+        for i, answer in zip(batch, parts):
+            answers[i] = answer
+
+    missing = [i for i in pending if answers[i] is None]
+    retried = llm_query_many([head + questions[i] + tail for i in missing], timeout=timeout)
+    for i, answer in zip(missing, retried):
+        answers[i] = answer
+    for i in pending:
+        llm_cache_put_question(context, questions[i], answers[i])
+    return answers
+
+
+def build_batch_question(questions) -> str:
+    """Row-marshal several questions into one prompt section, answers split by ===Q{i}===."""
+    lines = ["请依次回答以下问题，每个回答前单独一行写分隔符 ===Q{序号}===（如 ===Q1===）："]
+    lines += [f"{i}) {q}" for i, q in enumerate(questions, 1)]
+    return "\n".join(lines)
+
+
+def split_batch_answers(text: str, n: int):
+    """Split a batched response into n answers; slots the LLM skipped are None."""
+    answers = [None] * n
+    parts = _BATCH_MARKER_RE.split(text)
+    # parts = [preamble, idx1, body1, idx2, body2, ...]
+    for idx, body in zip(parts[1::2], parts[2::2]):
+        i = int(idx) - 1
+        body = body.strip()
+        if 0 <= i < n and body and answers[i] is None:
+            answers[i] = body
+    return answers
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for cache lookup: drop whitespace/punctuation, lowercase."""
+    return _QUESTION_NOISE_RE.sub("", question).lower()
+
+
+def find_cached_question(question: str, candidates):
+    """Return question's normalized key if candidates holds it, else None.
+
+    Only an exact match after normalize_question counts: questions that
+    differ in a year, a number or asc/desc look alike to fuzzy matching but
+    need different answers.
+    """
+    key = normalize_question(question)
+    return key if key in candidates else None
+
+
 def save_history(action: str, file: str, query: str, result_preview: str):
-    """Save query history."""
+    """Append one entry to the query history (one JSON object per line)."""
     ensure_state_dir()
-    history = []
-    if HISTORY_FILE.exists():
-        try:
-            history = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-        except (json.JSONDecodeError, IOError):
-            logger.warning("Failed to load history, starting fresh")
-            history = []
-    history.append({
+    entry = {
         "timestamp": datetime.now().isoformat(),
         "action": action,
         "file": str(file),
         "query": query,
         "result_preview": result_preview[:200],
-    })
-    # Keep last 100 entries
-    history = history[-100:]
-    HISTORY_FILE.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+    }
+    orjson = _orjson()
+    if orjson is not None:
+        line = orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+    else:
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+    try:
+        with open(HISTORY_FILE, "ab") as f:
+            f.write(line)
+            size = f.tell()
+    except OSError as e:
+        logger.warning("Failed to save history: %s", e)
+        return
+    if size > HISTORY_ROTATE_BYTES:
+        _rotate_history()
+
+
+def _rotate_history():
+    """Rewrite the history file with only its last HISTORY_MAX_ENTRIES lines."""
+    try:
+        with open(HISTORY_FILE, encoding="utf-8") as f:
+            tail = deque(f, maxlen=HISTORY_MAX_ENTRIES)
+        tmp = HISTORY_FILE.with_name(f"{HISTORY_FILE.name}.{os.getpid()}.tmp")
+        tmp.write_text("".join(tail), encoding="utf-8")
+        os.replace(tmp, HISTORY_FILE)
+        LEGACY_HISTORY_FILE.unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning("Failed to rotate history: %s", e)
+
+
+def load_history(limit=None):
+    """Return the history entries, oldest first.
+
+    Lines that do not parse (e.g. a write cut short by a crash) are skipped.
+    Entries from the old single-JSON history.json come first. With limit,
+    only the newest limit entries are returned, parsed from the last
+    HISTORY_TAIL_BYTES of the file when those hold enough of them.
+    """
+    orjson = _orjson()
+    loads = orjson.loads if orjson is not None else json.loads
+
+    def parse(lines):
+        entries = []
+        for line in lines:
+            try:
+                entries.append(loads(line))
+            except ValueError:  # json and orjson decode errors alike
+                continue
+        return entries
+
+    history = []
+    try:
+        with open(HISTORY_FILE, "rb") as f:
+            start = 0
+            if limit is not None:
+                start = max(0, f.seek(0, os.SEEK_END) - HISTORY_TAIL_BYTES)
+                f.seek(start)
+                if start:
+                    f.readline()  # drop the line the seek landed in
+            history = parse(f)
+            if start and len(history) < limit:
+                f.seek(0)
+                history = parse(f)
+    except FileNotFoundError:
+        pass
+    if limit is not None and len(history) >= limit:
+        return history[-limit:]
+    if LEGACY_HISTORY_FILE.exists():
+        try:
+            history = json.loads(LEGACY_HISTORY_FILE.read_text(encoding="utf-8")) + history
+        except (json.JSONDecodeError, IOError):
+            logger.warning("Failed to load legacy history %s", LEGACY_HISTORY_FILE)
+    return history if limit is None else history[-limit:]
+
+
+# ---------------------------------------------------------------------------
+# Prompt instructions — static text that leads each prompt, so repeated calls
+# share the longest possible prefix (provider-side prompt caching); the
+# per-call data and the user's request follow it
+# ---------------------------------------------------------------------------
+
+DIAGNOSE_INSTRUCTIONS = """你是一个数据科学家。请对下方数据集进行深度诊断，给出专业建议。
+
+## 请给出简洁的诊断意见
+1. **数据健康度** — 一句话总结
+2. **最关键的3个问题** — 如有
+3. **快速改进建议** — 立即可行的 2-3 个步骤
+4. **深入分析方向** — 值得探索的 2-3 个方向
+
+简洁为主，每点 1-2 句话。中文回答。"""
+
+PLOT_INSTRUCTIONS = """你是一个数据可视化专家。请根据最后的用户要求生成 Python matplotlib 绘图代码。
+
+## 代码要求
+1. 使用 pandas + matplotlib
+2. 中文标题和标签（使用 plt.rcParams 设置中文字体）
+3. 美观的配色方案
+4. 代码可直接运行
+5. 读取下方「文件路径」给出的文件
+6. 保存图片到同目录
+7. 打印保存路径
+
+只输出 Python 代码，不要解释。用 ```python ``` 包裹。"""
+
+QUERY_INSTRUCTIONS = """你是一个 Python pandas 专家。请根据最后的用户查询需求生成 pandas 代码。
+
+## 代码要求
+1. 读取 CSV: pd.read_csv(下方「文件路径」给出的文件)
+2. 执行查询
+3. 打印结果（用 to_string() 或 to_markdown() 格式化）
+4. 如果结果是数值，直接打印
+5. 只输出可执行的 Python 代码
+6. 不要使用 tabulate（可能未安装）
+
+只输出代码，用 ```python ``` 包裹。"""
+
+COMPARE_INSTRUCTIONS = """你是一个数据分析师。请比较下方两个数据集并给出详细分析。
+
+## 请分析
+1. 🔍 **结构差异** — 列名、类型、数量对比
+2. 📊 **数据差异** — 数值范围、分布、趋势对比
+3. 🔗 **共同点** — 相同的列、可关联的字段
+4. 💡 **洞察** — 两个数据集结合后可以得出什么结论
+5. 🛠️ **合并建议** — 如何合并这两个数据集
+
+用中文回答，用 markdown 格式。"""
+
+
+# Child process for generated code: imports the modules named in argv[2:],
+# then runs the script read from stdin as if it were the file in argv[1]
+_SCRIPT_RUNNER = """\
+import sys
+for name in sys.argv[2:]:
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+path = sys.argv[1]
+code = sys.stdin.read()
+sys.argv = [path]
+exec(compile(code, path, "exec"), {"__name__": "__main__", "__file__": path})
+"""
+
+
+def start_script_runner(path, preload=(), **popen_kwargs):
+    """Start a Python process that preimports preload and then waits for a
+    script on stdin (send it with communicate()).
+
+    Started before the LLM call, the interpreter startup and heavy imports
+    (pandas, matplotlib) overlap the wait for the generated code.
+    """
+    return subprocess.Popen(
+        [sys.executable, "-c", _SCRIPT_RUNNER, str(path), *preload],
+        stdin=subprocess.PIPE, text=True, encoding="utf-8", **popen_kwargs,
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -703,10 +1813,12 @@ def save_history(action: str, file: str, query: str, result_preview: str):
 
 def cmd_info(args):
     """Show dataset information with enhanced diagnostics."""
-    ctx = DataContext(args.file)
+    ctx = DataContext(args.file, scan_rows=None if args.full else SCAN_ROWS)
 
     print(f"\n📊 数据集: {args.file}")
     print(f"   行数: {len(ctx.data):,}  |  列数: {len(ctx.headers)}  |  分隔符: {repr(ctx.delimiter)}")
+    if ctx.scan_rows:
+        print(f"   ℹ️  以下统计基于前 {ctx.scan_rows:,} 行采样，使用 --full 分析全部行")
 
     # Quality score
     q = ctx.quality
@@ -761,13 +1873,13 @@ def cmd_info(args):
 
 
 def cmd_ask(args):
-    """Ask a natural language question about the data."""
+    """Ask one or more natural language questions about the data."""
     ctx = DataContext(args.file)
 
     sample_rows = min(MAX_ANALYSIS_ROWS, len(ctx.data))
     table = ctx.sample_table(sample_rows)
 
-    prompt = f"""你是一个专业的数据分析师。请根据以下 CSV 数据回答用户的问题。
+    head = f"""你是一个专业的数据分析师。请根据以下 CSV 数据回答用户的问题。
 
 {ctx.schema_prompt}
 
@@ -779,7 +1891,8 @@ def cmd_ask(args):
 {table}
 
 ## 用户问题
-{args.question}
+"""
+    tail = """
 
 ## 回答要求
 1. 用中文回答
@@ -788,13 +1901,34 @@ def cmd_ask(args):
 4. 指出数据中的有趣发现
 5. 如果数据不足以回答，说明原因并建议需要什么额外数据"""
 
-    print(f"\n🤔 分析中: {args.question}")
+    questions = args.question
+    if len(questions) > 1:
+        # Several questions share the data prefix: batch them into few LLM calls
+        print(f"\n🤔 分析中: {len(questions)} 个问题")
+        answers = llm_ask_many(head, tail, questions, timeout=90)
+        for question, result in zip(questions, answers):
+            print("─" * 60)
+            print(f"❓ {question}\n")
+            print(result)
+            save_history("ask", args.file, question, result)
+        print("─" * 60)
+        return
+
+    question = questions[0]
+    print(f"\n🤔 分析中: {question}")
     print("─" * 60)
-    result = llm_query(prompt, timeout=90)
-    print(result)
+    # The same question (up to case, spacing and punctuation) on the same
+    # data reuses its answer
+    result = llm_cache_get_question(head + tail, question)
+    if result is not None:
+        logger.info("Question cache hit: %s", question)
+        print(result)
+    else:
+        result = llm_print(head + question + tail, timeout=90)
+        llm_cache_put_question(head + tail, question, result)
     print("─" * 60)
 
-    save_history("ask", args.file, args.question, result)
+    save_history("ask", args.file, question, result)
 
 
 def cmd_report(args):
@@ -859,8 +1993,7 @@ def cmd_report(args):
 
     print(f"\n📝 生成分析报告: {args.file}")
     print("═" * 60)
-    result = llm_query(prompt, timeout=120)
-    print(result)
+    result = llm_print(prompt, timeout=120)
     print("═" * 60)
 
     # Save report
@@ -941,8 +2074,7 @@ def cmd_clean(args):
     quality_emoji = "🟢" if q["overall"] >= 80 else ("🟡" if q["overall"] >= 60 else "🔴")
     print(f"   当前质量分: {quality_emoji} {q['overall']}/100")
     print("─" * 60)
-    result = llm_query(prompt, timeout=90)
-    print(result)
+    result = llm_print(prompt, timeout=90)
     print("─" * 60)
 
     save_history("clean", args.file, "clean_analysis", result)
@@ -961,41 +2093,44 @@ def cmd_diagnose(args):
     print(f"\n📊 数据质量评分: {quality_emoji} {q['overall']}/100")
     print(f"   完整性: {q['completeness']}  |  一致性: {q['consistency']}  |  有效性: {q['validity']}")
 
-    # 2. Column Diagnostics
-    print(f"\n📋 列诊断:")
-    details = ctx.type_details
+    # 2. Column Diagnostics (one write for the whole section; wide files have hundreds of columns)
+    lines = ["\n📋 列诊断:"]
+    details, col_types, stats = ctx.type_details, ctx.col_types, ctx.stats
     for h in ctx.headers:
         d = details.get(h, {})
-        t = ctx.col_types.get(h, "?")
-        status = "🟢" if d.get("empty_pct", 0) < 5 else ("🟡" if d.get("empty_pct", 0) < 20 else "🔴")
-        print(f"   {status} {h}: type={t}, unique={d.get('unique','?')}, empty={d.get('empty_pct',0)}%", end="")
-        if h in ctx.stats:
-            s = ctx.stats[h]
-            print(f", range=[{s['min']}, {s['max']}], σ={s['std_dev']}", end="")
-        print()
-
-    # 3. Outlier Report
+        empty_pct = d.get("empty_pct", 0)
+        status = "🟢" if empty_pct < 5 else ("🟡" if empty_pct < 20 else "🔴")
+        line = f"   {status} {h}: type={col_types.get(h, '?')}, unique={d.get('unique', '?')}, empty={empty_pct}%"
+        s = stats.get(h)
+        if s:
+            line += f", range=[{s['min']}, {s['max']}], σ={s['std_dev']}"
+        lines.append(line)
+    print("\n".join(lines))
+
+    # 3. Outlier Report (one write, like the column section)
     if ctx.outliers:
-        print(f"\n⚠️  异常值检测 (IQR方法):")
+        lines = ["\n⚠️  异常值检测 (IQR方法):"]
         for h, o in ctx.outliers.items():
-            print(f"   📍 {h}: {o['count']}个异常值 ({o['percentage']}%)")
-            print(f"      正常范围: [{o['lower_bound']}, {o['upper_bound']}]")
-            print(f"      异常值样例: {o['values'][:5]}")
+            lines.append(f"   📍 {h}: {o['count']}个异常值 ({o['percentage']}%)")
+            lines.append(f"      正常范围: [{o['lower_bound']}, {o['upper_bound']}]")
+            lines.append(f"      异常值样例: {o['values'][:5]}")
+        print("\n".join(lines))
     else:
         print(f"\n✅ 未检测到显著异常值")
 
     # 4. Visualization Recommendations
     if ctx.viz_suggestions:
-        print(f"\n📊 可视化建议:")
+        lines = ["\n📊 可视化建议:"]
         for i, s in enumerate(ctx.viz_suggestions[:5], 1):
             priority_emoji = {"high": "🔴", "medium": "🟡", "low": "🟢"}.get(s.get("priority", ""), "⚪")
-            print(f"   {i}. {priority_emoji} {s['type']} — {s['reason']}")
+            lines.append(f"   {i}. {priority_emoji} {s['type']} — {s['reason']}")
+        print("\n".join(lines))
 
     # 5. AI Deep Diagnosis
-    sample_rows = min(50, len(ctx.data))
-    table = ctx.sample_table(sample_rows)
+    sample_rows = min(SMART_SAMPLE_ROWS, len(ctx.data))
+    table = ctx.smart_sample()
 
-    prompt = f"""你是一个数据科学家。请对以下数据集进行深度诊断，给出专业建议。
+    prompt = f"""{DIAGNOSE_INSTRUCTIONS}
 
 {ctx.schema_prompt}
 
@@ -1005,21 +2140,12 @@ def cmd_diagnose(args):
 
 {ctx.quality_text()}
 
-## 数据样本 (前 {sample_rows} 行)
-{table}
-
-## 请给出简洁的诊断意见
-1. **数据健康度** — 一句话总结
-2. **最关键的3个问题** — 如有
-3. **快速改进建议** — 立即可行的 2-3 个步骤
-4. **深入分析方向** — 值得探索的 2-3 个方向
-
-简洁为主，每点 1-2 句话。中文回答。"""
+## 数据样本 ({sample_rows} 行，取自开头、结尾及中间均匀位置，共 {len(ctx.data)} 行)
+{table}"""
 
     print(f"\n🤖 AI 诊断意见:")
     print("─" * 60)
-    result = llm_query(prompt, timeout=60)
-    print(result)
+    result = llm_print(prompt, timeout=60)
     print("═" * 60)
 
     save_history("diagnose", args.file, "diagnose", result)
@@ -1027,7 +2153,9 @@ def cmd_diagnose(args):
 
 def cmd_plot(args):
     """Generate a Python matplotlib plotting script."""
-    ctx = DataContext(args.file)
+    # The generated code reads the whole file itself; the prompt only needs
+    # the schema, so the rows past SCHEMA_ROWS are never parsed here
+    ctx = DataContext(args.file, max_rows=SCHEMA_ROWS)
 
     # Include visualization suggestions in prompt
     viz_text = ""
@@ -1036,54 +2164,59 @@ def cmd_plot(args):
         for s in ctx.viz_suggestions[:3]:
             viz_text += f"- {s['type']}: {s['reason']}\n"
 
-    prompt = f"""你是一个数据可视化专家。请根据用户的描述生成 Python matplotlib 绑图代码。
+    prompt = f"""{PLOT_INSTRUCTIONS}
+
+## 文件路径
+{os.path.abspath(args.file)}
 
 {ctx.schema_prompt}
 
 {viz_text}
 
 ## 用户要求
-{args.description}
+{args.description}"""
 
-## 代码要求
-1. 使用 pandas + matplotlib
-2. 中文标题和标签（使用 plt.rcParams 设置中文字体）
-3. 美观的配色方案
-4. 代码可直接运行
-5. 读取文件路径: {os.path.abspath(args.file)}
-6. 保存图片到同目录
-7. 打印保存路径
+    # Save script next to the data
+    data_path = Path(args.file)
+    script_path = data_path.parent / f"plot_{data_path.stem}.py"
 
-只输出 Python 代码，不要解释。用 ```python ``` 包裹。"""
+    runner = None
+    if args.run:
+        # Start the interpreter and import pandas/matplotlib while the LLM works;
+        # the script is fed to it on stdin once it arrives. The script only saves
+        # the figure, so use the headless Agg backend instead of loading a GUI toolkit
+        runner = start_script_runner(
+            script_path, ("pandas", "matplotlib.pyplot"),
+            env={**os.environ, "MPLBACKEND": "Agg"},
+        )
 
     print(f"\n📊 生成可视化代码...")
     print("─" * 60)
     result = llm_query(prompt, timeout=60)
 
-    # Extract code block
-    code = result
-    if "```python" in result:
-        code = result.split("```python")[1].split("```")[0].strip()
-    elif "```" in result:
-        code = result.split("```")[1].split("```")[0].strip()
+    code = extract_code(result)
 
     if not code.strip():
         print("❌ LLM 未生成有效代码")
+        if runner is not None:
+            runner.kill()
+            runner.wait()
         return
 
-    # Save script
-    script_path = Path(args.file).parent / f"plot_{Path(args.file).stem}.py"
     script_path.write_text(code, encoding="utf-8")
     print(f"📝 绘图脚本已保存: {script_path}")
 
-    if args.run:
+    if runner is not None:
         print("\n🚀 运行绘图脚本...")
         try:
-            subprocess.run([sys.executable, str(script_path)], timeout=30, check=True)
-            print("✅ 图表生成成功!")
-        except subprocess.CalledProcessError as e:
-            print(f"❌ 运行失败: {e}")
+            runner.communicate(code, timeout=30)
+            if runner.returncode:
+                print(f"❌ 运行失败: exit status {runner.returncode}")
+            else:
+                print("✅ 图表生成成功!")
         except subprocess.TimeoutExpired:
+            runner.kill()
+            runner.wait()
             print("❌ 运行超时")
     else:
         print(f"💡 运行: python {script_path}")
@@ -1094,63 +2227,51 @@ def cmd_plot(args):
 
 def cmd_query(args):
     """Execute a SQL-like query on the CSV (via pandas)."""
-    ctx = DataContext(args.file)
+    # The generated code reads the whole file itself; the prompt only needs
+    # the schema, so the rows past SCHEMA_ROWS are never parsed here
+    ctx = DataContext(args.file, max_rows=SCHEMA_ROWS)
 
-    prompt = f"""你是一个 Python pandas 专家。请根据用户的查询需求生成 pandas 代码。
+    # Import pandas in the process that will run the generated code while the LLM works
+    runner = start_script_runner(
+        "<query>", ("pandas",), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
 
-{ctx.schema_prompt}
+    # Everything but the user's query
+    head = f"""{QUERY_INSTRUCTIONS}
 
-## 用户查询
-{args.sql}
+## 文件路径
+{os.path.abspath(args.file)}
 
-## 代码要求
-1. 读取 CSV: pd.read_csv("{os.path.abspath(args.file)}")
-2. 执行查询
-3. 打印结果（用 to_string() 或 to_markdown() 格式化）
-4. 如果结果是数值，直接打印
-5. 只输出可执行的 Python 代码
-6. 不要使用 tabulate（可能未安装）
+{ctx.schema_prompt}
 
-只输出代码，用 ```python ``` 包裹。"""
+## 用户查询
+"""
 
-    result = llm_query(prompt, timeout=60)
+    # Generated code is never reused across queries, even rephrased ones:
+    # a different number or column would silently run the wrong filter
+    result = llm_query(head + args.sql, timeout=60)
 
-    code = result
-    if "```python" in result:
-        code = result.split("```python")[1].split("```")[0].strip()
-    elif "```" in result:
-        code = result.split("```")[1].split("```")[0].strip()
+    code = extract_code(result)
 
     if not code.strip():
         print("❌ LLM 未生成有效代码")
+        runner.kill()
+        runner.communicate()
         return
 
     print(f"\n🔍 执行查询: {args.sql}")
     print("─" * 60)
 
-    # Execute the code in a temp file
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False, encoding="utf-8") as f:
-        f.write(code)
-        tmp = f.name
-
     try:
-        result = subprocess.run(
-            [sys.executable, tmp],
-            capture_output=True,
-            text=True,
-            timeout=30,
-        )
-        if result.stdout:
-            print(result.stdout)
-        if result.stderr:
-            print(f"⚠️ {result.stderr[:300]}")
+        stdout, stderr = runner.communicate(code, timeout=30)
+        if stdout:
+            print(stdout)
+        if stderr:
+            print(f"⚠️ {stderr[:300]}")
     except subprocess.TimeoutExpired:
+        runner.kill()
+        runner.communicate()
         print("❌ 查询执行超时")
-    finally:
-        try:
-            os.unlink(tmp)
-        except OSError:
-            pass
 
     print("─" * 60)
     save_history("query", args.file, args.sql, code[:200])
@@ -1161,10 +2282,10 @@ def cmd_compare(args):
     ctx1 = DataContext(args.file1)
     ctx2 = DataContext(args.file2)
 
-    table1 = ctx1.sample_table(10)
-    table2 = ctx2.sample_table(10)
+    table1 = ctx1.smart_sample(10)
+    table2 = ctx2.smart_sample(10)
 
-    prompt = f"""你是一个数据分析师。请比较以下两个数据集并给出详细分析。
+    prompt = f"""{COMPARE_INSTRUCTIONS}
 
 ## 数据集 1: {args.file1}
 {ctx1.schema_prompt}
@@ -1174,21 +2295,11 @@ def cmd_compare(args):
 ## 数据集 2: {args.file2}
 {ctx2.schema_prompt}
 {ctx2.stats_text()}
-{table2}
-
-## 请分析
-1. 🔍 **结构差异** — 列名、类型、数量对比
-2. 📊 **数据差异** — 数值范围、分布、趋势对比
-3. 🔗 **共同点** — 相同的列、可关联的字段
-4. 💡 **洞察** — 两个数据集结合后可以得出什么结论
-5. 🛠️ **合并建议** — 如何合并这两个数据集
-
-用中文回答，用 markdown 格式。"""
+{table2}"""
 
     print(f"\n🔄 对比分析: {args.file1} vs {args.file2}")
     print("═" * 60)
-    result = llm_query(prompt, timeout=90)
-    print(result)
+    result = llm_print(prompt, timeout=90)
     print("═" * 60)
 
     save_history("compare", f"{args.file1} vs {args.file2}", "compare", result)
@@ -1196,24 +2307,25 @@ def cmd_compare(args):
 
 def cmd_history(args):
     """Show query history."""
-    if not HISTORY_FILE.exists():
+    if not HISTORY_FILE.exists() and not LEGACY_HISTORY_FILE.exists():
         print("📭 暂无历史记录")
         return
 
-    try:
-        history = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-    except (json.JSONDecodeError, IOError):
-        print("❌ 历史记录文件损坏")
-        return
-
     if args.clear:
-        HISTORY_FILE.unlink()
+        HISTORY_FILE.unlink(missing_ok=True)
+        LEGACY_HISTORY_FILE.unlink(missing_ok=True)
         print("✅ 历史记录已清除")
         return
 
-    print(f"\n📜 查询历史 (最近 {min(len(history), 20)} 条)")
+    try:
+        history = load_history(limit=20)
+    except IOError:
+        print("❌ 历史记录文件无法读取")
+        return
+
+    print(f"\n📜 查询历史 (最近 {len(history)} 条)")
     print("─" * 60)
-    for entry in history[-20:]:
+    for entry in history:
         ts = entry.get("timestamp", "?")[:19]
         action = entry.get("action", "?")
         file = Path(entry.get("file", "?")).name
@@ -1239,6 +2351,7 @@ def main():
 示例:
   csvwise info data.csv                          # 查看数据概览 + 质量评分
   csvwise ask data.csv "平均销售额是多少?"          # 提问
+  csvwise ask data.csv "问题1" "问题2"              # 多个问题合并为批量请求
   csvwise report data.csv -o report.md            # 生成分析报告
   csvwise clean data.csv                          # 数据清洗建议
   csvwise diagnose data.csv                       # AI 深度诊断
@@ -1250,17 +2363,19 @@ def main():
     )
     parser.add_argument("--version", action="version", version=f"csvwise {VERSION}")
     parser.add_argument("--verbose", "-v", action="store_true", help="显示详细日志")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 结果缓存和数据分析缓存")
 
     sub = parser.add_subparsers(dest="command", help="可用命令")
 
     # info
     p_info = sub.add_parser("info", help="查看数据集概览 + 质量评分")
     p_info.add_argument("file", help="CSV 文件路径")
+    p_info.add_argument("--full", action="store_true", help=f"分析全部行（默认只分析前 {SCAN_ROWS} 行）")
 
     # ask
     p_ask = sub.add_parser("ask", help="用自然语言提问")
     p_ask.add_argument("file", help="CSV 文件路径")
-    p_ask.add_argument("question", help="你的问题")
+    p_ask.add_argument("question", nargs="+", help="你的问题（可给多个，合并为批量请求）")
 
     # report
     p_report = sub.add_parser("report", help="生成全面分析报告")
@@ -1300,6 +2415,12 @@ def main():
     # Setup logging
     setup_logging(verbose=getattr(args, "verbose", False))
 
+    global LLM_CACHE_ENABLED, ANALYTICS_CACHE_ENABLED
+    if args.no_cache:
+        LLM_CACHE_ENABLED = False
+    else:
+        ANALYTICS_CACHE_ENABLED = True
+
     if not args.command:
         parser.print_help()
         sys.exit(0)
@@ -6,15 +6,25 @@ Database Connector for csvwise
 
 import os
 import sqlite3
-from typing import Any, Dict, List, Optional, Tuple
+import time
+from contextlib import ExitStack, contextmanager
+from importlib.util import find_spec
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse
 
-# PostgreSQL support (optional)
-try:
-    import psycopg2
-    HAS_POSTGRES = True
-except ImportError:
-    HAS_POSTGRES = False
+# PostgreSQL support (optional)；只检查是否安装，真正连接时才导入
+HAS_POSTGRES = find_spec("psycopg2") is not None
+
+# SQLite COUNT(*) 超过这个耗时（秒）就缓存结果，避免大表反复全表扫描
+SLOW_COUNT_SECONDS = 0.2
+
+# PostgreSQL 连接池上限（Streamlit 多会话并发时共用一个连接器）
+PG_POOL_MAX_CONN = 10
+
+
+def quote_identifier(name: str) -> str:
+    """把表名/列名转成带双引号的 SQL 标识符（SQLite 和 PostgreSQL 通用），防止拼接注入"""
+    return '"' + name.replace('"', '""') + '"'
 
 
 class DatabaseConnector:
@@ -31,7 +41,21 @@ class DatabaseConnector:
         """
         self.connection_string = connection_string
         self.db_type = self._detect_db_type(connection_string)
-        self.conn = None
+        self._conn = None  # SQLite 连接（所有线程共用）；PostgreSQL 下是 .conn 借出的连接
+        self._pool = None  # PostgreSQL 连接池
+        self._row_counts: Dict[str, int] = {}
+    
+    @property
+    def conn(self):
+        """
+        底层 DB-API 连接（保持原有的公开属性，供直接写 SQL 的调用方使用）
+        
+        SQLite 就是共用的那个连接；PostgreSQL 第一次访问时从连接池借出一个连接专门给 .conn 用，
+        close() 时随连接池一起关闭。未连接时为 None。
+        """
+        if self._pool is not None and self._conn is None:
+            self._conn = self._pool.getconn()
+        return self._conn
         
     def _detect_db_type(self, conn_str: str) -> str:
         """检测数据库类型"""
@@ -53,21 +77,56 @@ class DatabaseConnector:
                 path = path[10:]
             if not os.path.exists(path):
                 raise FileNotFoundError(f"SQLite 数据库不存在: {path}")
-            self.conn = sqlite3.connect(path)
-            self.conn.row_factory = sqlite3.Row
+            # Streamlit 每次重新运行可能在不同线程，sqlite3 为串行化模式，可跨线程共用
+            # 保持默认的 tuple 行：结果直接就是 List[Tuple]，不必再逐行 tuple(row) 复制
+            self._conn = sqlite3.connect(path, check_same_thread=False)
             
         elif self.db_type == "postgresql":
-            if not HAS_POSTGRES:
-                raise ImportError("需要安装 psycopg2: pip install psycopg2-binary")
-            self.conn = psycopg2.connect(self.connection_string)
+            try:
+                import psycopg2.pool
+            except ImportError:
+                raise ImportError("需要安装 psycopg2: pip install psycopg2-binary") from None
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                1, PG_POOL_MAX_CONN, self.connection_string
+            )
             
         return self
     
     def close(self):
         """关闭连接"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        if self._pool:
+            self._pool.closeall()  # 也关闭 .conn 借出的连接
+            self._pool = None
+        elif self._conn:
+            self._conn.close()
+        self._conn = None
+    
+    @contextmanager
+    def _cursor(self, name: Optional[str] = None):
+        """
+        借出一个游标，用完关闭
+        
+        PostgreSQL 从连接池取连接，归还前结束只读事务；SQLite 共用同一个连接。
+        name 非空时在 PostgreSQL 上创建服务端游标。
+        """
+        if self._pool is None:
+            cursor = self._conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            return
+        
+        conn = self._pool.getconn()
+        try:
+            cursor = conn.cursor(name=name) if name else conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        finally:
+            conn.rollback()
+            self._pool.putconn(conn)
     
     def __enter__(self):
         self.connect()
@@ -78,63 +137,82 @@ class DatabaseConnector:
     
     def list_tables(self) -> List[str]:
         """列出所有表"""
-        cursor = self.conn.cursor()
-        
-        if self.db_type == "sqlite":
-            cursor.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
-            )
-        elif self.db_type == "postgresql":
-            cursor.execute(
-                "SELECT tablename FROM pg_tables WHERE schemaname = 'public'"
-            )
-        
-        tables = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        return tables
+        with self._cursor() as cursor:
+            if self.db_type == "sqlite":
+                cursor.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+                )
+            elif self.db_type == "postgresql":
+                cursor.execute(
+                    "SELECT tablename FROM pg_tables WHERE schemaname = 'public'"
+                )
+            
+            return [row[0] for row in cursor.fetchall()]
     
     def get_table_schema(self, table_name: str) -> List[Dict[str, str]]:
         """获取表结构"""
-        cursor = self.conn.cursor()
+        with self._cursor() as cursor:
+            if self.db_type == "sqlite":
+                cursor.execute(f"PRAGMA table_info({quote_identifier(table_name)})")
+                columns = []
+                for row in cursor.fetchall():
+                    columns.append({
+                        "name": row[1],
+                        "type": row[2],
+                        "nullable": not row[3],
+                        "default": row[4],
+                        "pk": bool(row[5])
+                    })
+                    
+            elif self.db_type == "postgresql":
+                cursor.execute(f"""
+                    SELECT column_name, data_type, is_nullable, column_default
+                    FROM information_schema.columns
+                    WHERE table_name = %s
+                    ORDER BY ordinal_position
+                """, (table_name,))
+                columns = []
+                for row in cursor.fetchall():
+                    columns.append({
+                        "name": row[0],
+                        "type": row[1],
+                        "nullable": row[2] == "YES",
+                        "default": row[3],
+                        "pk": False  # 需要额外查询
+                    })
         
-        if self.db_type == "sqlite":
-            cursor.execute(f"PRAGMA table_info('{table_name}')")
-            columns = []
-            for row in cursor.fetchall():
-                columns.append({
-                    "name": row[1],
-                    "type": row[2],
-                    "nullable": not row[3],
-                    "default": row[4],
-                    "pk": bool(row[5])
-                })
-                
-        elif self.db_type == "postgresql":
-            cursor.execute(f"""
-                SELECT column_name, data_type, is_nullable, column_default
-                FROM information_schema.columns
-                WHERE table_name = %s
-                ORDER BY ordinal_position
-            """, (table_name,))
-            columns = []
-            for row in cursor.fetchall():
-                columns.append({
-                    "name": row[0],
-                    "type": row[1],
-                    "nullable": row[2] == "YES",
-                    "default": row[3],
-                    "pk": False  # 需要额外查询
-                })
-        
-        cursor.close()
         return columns
     
-    def get_table_row_count(self, table_name: str) -> int:
-        """获取表行数"""
-        cursor = self.conn.cursor()
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-        count = cursor.fetchone()[0]
-        cursor.close()
+    def get_table_row_count(self, table_name: str, estimate: bool = False) -> int:
+        """
+        获取表行数
+        
+        Args:
+            estimate: 允许返回估算值，避免大表 COUNT(*) 全表扫描
+                - PostgreSQL: 读取 pg_class.reltuples（表从未 ANALYZE 时退回精确计数；
+                  PostgreSQL 14 之前未分析的表 reltuples 为 0，同样视为未知）
+                - SQLite: 复用之前较慢的精确计数结果
+        """
+        if estimate and table_name in self._row_counts:
+            return self._row_counts[table_name]
+        
+        with self._cursor() as cursor:
+            if estimate and self.db_type == "postgresql":
+                # 按 oid 定位，和下面的 COUNT(*) 解析到同一张表（同名的其他 schema 表或索引不会混进来）
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                    (quote_identifier(table_name),),
+                )
+                row = cursor.fetchone()
+                if row and row[0] > 0:
+                    return row[0]
+            
+            start = time.perf_counter()
+            cursor.execute(f"SELECT COUNT(*) FROM {quote_identifier(table_name)}")
+            count = cursor.fetchone()[0]
+        
+        if time.perf_counter() - start > SLOW_COUNT_SECONDS:
+            self._row_counts[table_name] = count
         return count
     
     def query_table(
@@ -150,28 +228,66 @@ class DatabaseConnector:
         Returns:
             (headers, rows) - 列名列表和数据行
         """
-        cursor = self.conn.cursor()
+        with self._cursor() as cursor:
+            headers = self._select_table(cursor, table_name, limit, offset, columns)
+            rows = cursor.fetchall()
         
-        col_str = ", ".join(columns) if columns else "*"
-        
-        if self.db_type == "sqlite":
-            cursor.execute(f"SELECT {col_str} FROM {table_name} LIMIT ? OFFSET ?", (limit, offset))
-        elif self.db_type == "postgresql":
-            cursor.execute(f"SELECT {col_str} FROM {table_name} LIMIT %s OFFSET %s", (limit, offset))
+        return headers, rows
+    
+    def iter_table_rows(
+        self,
+        table_name: str,
+        limit: int = 1000,
+        chunk_size: int = 1000,
+        columns: Optional[List[str]] = None
+    ) -> Tuple[List[str], Iterator[Tuple]]:
+        """
+        分批读取表数据，避免一次性 fetchall 物化所有行
         
-        # 获取列名
-        if self.db_type == "sqlite":
-            headers = [desc[0] for desc in cursor.description]
-        else:
+        Returns:
+            (headers, rows) - 列名列表和按 chunk_size 分批 fetchmany 的行迭代器；
+            连接在迭代结束（或迭代器被关闭）时归还
+        """
+        # PostgreSQL 用服务端游标：结果集留在服务器上，fetchmany 按批拉取，而不是 execute 时整表传到客户端
+        stack = ExitStack()
+        cursor = stack.enter_context(
+            self._cursor(name="csvwise_iter_table" if self.db_type == "postgresql" else None)
+        )
+        try:
+            if self.db_type == "postgresql":
+                cursor.itersize = chunk_size
+            self._execute_select(cursor, table_name, limit, 0, columns)
+            # 服务端游标要取过一批数据后 description 才可用
+            first = cursor.fetchmany(chunk_size)
             headers = [desc[0] for desc in cursor.description]
+        except BaseException:
+            stack.close()
+            raise
         
-        rows = cursor.fetchall()
-        cursor.close()
+        def rows(chunk):
+            with stack:
+                while chunk:
+                    yield from chunk
+                    chunk = cursor.fetchmany(chunk_size)
         
-        # 转换为元组列表
-        rows = [tuple(row) for row in rows]
+        return headers, rows(first)
+    
+    def _select_table(self, cursor, table_name: str, limit: int, offset: int,
+                      columns: Optional[List[str]] = None) -> List[str]:
+        """执行 SELECT ... LIMIT/OFFSET，返回列名"""
+        self._execute_select(cursor, table_name, limit, offset, columns)
+        return [desc[0] for desc in cursor.description]
+    
+    def _execute_select(self, cursor, table_name: str, limit: int, offset: int,
+                        columns: Optional[List[str]] = None):
+        """执行 SELECT ... LIMIT/OFFSET（表名、列名加引号；SQL 文本固定，sqlite3 会复用缓存的预编译语句）"""
+        col_str = ", ".join(map(quote_identifier, columns)) if columns else "*"
+        table = quote_identifier(table_name)
         
-        return headers, rows
+        if self.db_type == "sqlite":
+            cursor.execute(f"SELECT {col_str} FROM {table} LIMIT ? OFFSET ?", (limit, offset))
+        elif self.db_type == "postgresql":
+            cursor.execute(f"SELECT {col_str} FROM {table} LIMIT %s OFFSET %s", (limit, offset))
     
     def execute_query(self, sql: str, params: tuple = ()) -> Tuple[List[str], List[Tuple]]:
         """
@@ -180,25 +296,24 @@ class DatabaseConnector:
         Returns:
             (headers, rows)
         """
-        cursor = self.conn.cursor()
-        cursor.execute(sql, params)
-        
-        if cursor.description:
-            headers = [desc[0] for desc in cursor.description]
-            rows = [tuple(row) for row in cursor.fetchall()]
-        else:
-            headers = []
-            rows = []
+        with self._cursor() as cursor:
+            cursor.execute(sql, params)
+            
+            if cursor.description:
+                headers = [desc[0] for desc in cursor.description]
+                rows = cursor.fetchall()
+            else:
+                headers = []
+                rows = []
         
-        cursor.close()
         return headers, rows
     
     def table_to_csv_string(self, table_name: str, limit: int = 1000) -> str:
-        """将表数据转换为 CSV 字符串（用于兼容 csvwise）"""
+        """将表数据转换为 CSV 字符串（用于兼容 csvwise），按批 fetchmany 直接写入缓冲区"""
         import io
         import csv
         
-        headers, rows = self.query_table(table_name, limit=limit)
+        headers, rows = self.iter_table_rows(table_name, limit=limit)
         
         output = io.StringIO()
         writer = csv.writer(output)
@@ -220,7 +335,7 @@ def get_db_info(connection_string: str) -> Dict[str, Any]:
         
         for table in tables:
             schema = db.get_table_schema(table)
-            row_count = db.get_table_row_count(table)
+            row_count = db.get_table_row_count(table, estimate=True)
             info["tables"][table] = {
                 "columns": schema,
                 "row_count": row_count
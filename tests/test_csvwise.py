@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 """Tests for csvwise v0.2.0 (no LLM required)."""
 
+import contextlib
 import os
+import sqlite3
 import sys
 import tempfile
+import time
+from pathlib import Path
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
 import csvwise
+import db_connector
 
 
 # ---------------------------------------------------------------------------
@@ -36,6 +41,17 @@ def test_infer_column_types():
     assert types["name"] == "text"
     assert types["score"] == "numeric"
     assert types["date"] == "date"
+    # Dates are matched like strptime: real days only, any of DATE_FORMATS
+    types = csvwise.infer_column_types(["d", "cn", "e"], [
+        ["2026-02-30", "2026年1月5日", "1e-5"],
+        ["2026-02-31", "2026年12月31日", "2.5E-3"],
+        ["2026-02-28", "2026年2月29日", "-7"],
+    ])
+    assert types["d"] != "date" and types["cn"] == "date" and types["e"] == "numeric"
+    # float() also takes non-ASCII digits, so those cells still count as numbers
+    data = [["１２"], ["٣"], ["5"], ["n/a"]]
+    assert csvwise.infer_column_types(["n"], data)["n"] == "numeric"
+    assert csvwise.numeric_values(data, 0) == [12.0, 3.0, 5.0]
 
 
 def test_compute_basic_stats():
@@ -79,6 +95,8 @@ def test_build_schema_prompt():
     prompt = csvwise.build_schema_prompt(headers, data, types)
     assert "name" in prompt
     assert "numeric" in prompt
+    # Sample values keep first-appearance order, so the prompt is reproducible
+    assert "示例值: test, demo" in prompt
 
 
 def test_gbk_csv():
@@ -239,6 +257,9 @@ def test_data_context_outliers():
         ctx = csvwise.DataContext(f.name)
         assert "value" in ctx.outliers
         assert ctx.outliers["value"]["count"] >= 1
+        assert ctx.outlier_count == sum(o["count"] for o in ctx.outliers.values())
+        assert list(ctx.numeric_array("value")) == [10.0 + i for i in range(20)] + [9999.0]
+        assert ctx.numeric_array("value") is ctx.numeric_array("value")
     os.unlink(f.name)
 
 
@@ -272,6 +293,471 @@ def test_csv_to_markdown_table_padded():
     # Each data line should have exactly 3 columns
     for line in lines[2:]:  # skip header and separator
         assert line.count("|") == 4  # 3 cols = 4 pipe chars
+    # Pipes and line breaks inside cells must not split cells or rows
+    md = csvwise.csv_to_markdown_table(["a|b", "c"], [["x|y", "line1\r\nline2"]])
+    assert md.splitlines() == ["| a\\|b | c |", "| --- | --- |", "| x\\|y | line1 line2 |"]
+
+
+def test_load_csv_from_bytes():
+    """Test loading CSV directly from in-memory bytes / buffers."""
+    import io
+    raw = "name,age\nAlice,30\nBob,25\n".encode("utf-8")
+    headers, data, delim = csvwise.load_csv(raw)
+    assert headers == ["name", "age"]
+    assert data == [["Alice", "30"], ["Bob", "25"]]
+    headers, data, _ = csvwise.load_csv(io.BytesIO("姓名,年龄\n张三,25\n".encode("gbk")))
+    assert headers[0] == "姓名"
+    headers, _, _ = csvwise.load_csv("姓名,年龄\n张三,25\n".encode("utf-8-sig"))
+    assert headers[0] == "姓名"
+    ctx = csvwise.DataContext(raw)
+    assert ctx.path is None
+    assert ctx.col_types["age"] == "numeric"
+
+
+def test_load_csv_shares_repeated_cells():
+    """Low-cardinality columns reuse one str per value; unique columns are untouched."""
+    lines = ["id,city"] + [f"{i},{'北京' if i % 2 else 'Shanghai'}" for i in range(100)]
+    headers, data, _ = csvwise.load_csv("\n".join(lines).encode("utf-8"))
+    assert data[1][1] is data[3][1] and data[0][1] is data[2][1]
+    assert [row[1] for row in data[:2]] == ["Shanghai", "北京"]
+    assert [row[0] for row in data[:3]] == ["0", "1", "2"]
+
+
+def test_detect_delimiter():
+    """Delimiter is the most frequent candidate in the header line."""
+    assert csvwise._detect_delimiter("a,b,c\n1,2,3\n") == ","
+    assert csvwise._detect_delimiter("a;b;c\n1,5;2;3\n") == ";"
+    assert csvwise._detect_delimiter("a|b\n1|2\n") == "|"
+    assert csvwise._detect_delimiter('"x, y"\tz\tw\n"1,2"\t3\t4\n') == "\t"
+    assert csvwise._detect_delimiter("single\nvalue\n") == ","
+    headers, data, delim = csvwise.load_csv("name\tprice\nA\t1,234\n".encode("utf-8"))
+    assert delim == "\t" and data == [["A", "1,234"]]
+
+
+def test_load_csv_encoding_past_sample():
+    """Encoding is picked from a leading sample but still checked on the whole file."""
+    pad = "x" * csvwise.ENCODING_SAMPLE_BYTES
+    with tempfile.NamedTemporaryFile(mode="wb", suffix=".csv", delete=False) as f:
+        f.write(f"name,note\nAlice,{pad}\n张三,北京\n".encode("gbk"))
+    headers, data, _ = csvwise.load_csv(f.name)
+    os.unlink(f.name)
+    assert data[1] == ["张三", "北京"]
+    # A multi-byte character split by the sample boundary is still UTF-8
+    raw = ("a,b\n1," + "y" * (csvwise.ENCODING_SAMPLE_BYTES - 7) + "é\n").encode("utf-8")
+    headers, data, _ = csvwise.load_csv(raw)
+    assert data[0][1].endswith("é")
+
+
+def test_data_context_from_rows():
+    """Pre-parsed rows are used as-is, with cells stringified like csv.writer."""
+    ctx = csvwise.DataContext(headers=("id", "score"), rows=[(1, 9.5), (2, None)])
+    assert ctx.path is None
+    assert ctx.headers == ["id", "score"]
+    assert ctx.data == [["1", "9.5"], ["2", ""]]
+    assert ctx.col_types["score"] == "numeric"
+
+
+def test_data_context_scan_rows():
+    """scan_rows bounds the analytics but not the column helpers."""
+    rows = [(i, i * 2) for i in range(50)]
+    ctx = csvwise.DataContext(headers=("id", "v"), rows=rows, scan_rows=10)
+    assert ctx.scan_rows == 10
+    assert ctx.stats["v"]["count"] == 10
+    assert ctx.stats["v"]["max"] == 18
+    assert len(ctx.numeric_column("v")) == 50
+    assert len(ctx.numeric_array("v")) == 50
+    full = csvwise.DataContext(headers=("id", "v"), rows=rows, scan_rows=100)
+    assert full.scan_rows is None and full.stats["v"]["count"] == 50
+
+
+def test_data_context_max_rows():
+    """max_rows stops loading early and the schema says the file is longer."""
+    raw = ("id,v\n" + "".join(f"{i},{i * 2}\n" for i in range(50))).encode("utf-8")
+    headers, data, _ = csvwise.load_csv(raw, max_rows=5)
+    assert headers == ["id", "v"] and len(data) == 5
+    ctx = csvwise.DataContext(raw, max_rows=10)
+    assert ctx.truncated and len(ctx.data) == 10 and ctx.scan_rows == 10
+    assert ctx.stats["v"]["max"] == 18
+    assert "总行数: 超过 10" in ctx.schema_prompt
+    full = csvwise.DataContext(raw, max_rows=50)
+    assert not full.truncated and len(full.data) == 50
+    assert "总行数: 50\n" in full.schema_prompt
+
+
+def test_smart_sample():
+    """smart_sample spans head, middle and tail and cuts wide cells."""
+    rows = [(i, "x" * 100) for i in range(100)]
+    ctx = csvwise.DataContext(headers=("id", "note"), rows=rows)
+    table = ctx.smart_sample()
+    ids = [int(line.split("|")[1]) for line in table.splitlines()[2:]]
+    assert len(ids) == 15 and ids == sorted(set(ids))
+    assert ids[:5] == [0, 1, 2, 3, 4] and ids[-5:] == [95, 96, 97, 98, 99]
+    assert "x" * 40 + "..." in table and "x" * 41 not in table
+    small = csvwise.DataContext(headers=("id",), rows=[(1,), (2,)])
+    assert len(small.smart_sample().splitlines()) == 4
+
+
+def test_llm_cache_roundtrip():
+    """Persistent LLM cache stores successful responses only."""
+    old, old_ttl = csvwise.LLM_CACHE_FILE, csvwise.LLM_CACHE_TTL
+    with tempfile.TemporaryDirectory() as d:
+        csvwise.LLM_CACHE_FILE = Path(d) / "llm_cache.db"
+        # A cache file from before entries carried a timestamp is upgraded in place
+        legacy = sqlite3.connect(csvwise.LLM_CACHE_FILE)
+        legacy.execute("CREATE TABLE llm_cache (key BLOB PRIMARY KEY, response TEXT NOT NULL)")
+        legacy.execute("INSERT INTO llm_cache VALUES (?, ?)", (csvwise._llm_cache_key("old"), "stale"))
+        legacy.commit()
+        legacy.close()
+        csvwise._open_llm_cache.cache_clear()
+        try:
+            assert csvwise.llm_cache_get("prompt") is None
+            assert csvwise.llm_cache_get("old") is None
+            csvwise.llm_cache_put("prompt", "answer")
+            csvwise.llm_cache_put("bad", "❌ LLM 调用失败")
+            assert csvwise.llm_cache_get("prompt") == "answer"
+            assert csvwise.llm_cache_get("bad") is None
+            assert csvwise.llm_query("prompt") == "answer"
+            csvwise.llm_cache_put_question("ctx", "平均销售额是多少？", "均值 42")
+            assert csvwise.llm_cache_get_question("ctx", "平均销售额是多少") == "均值 42"
+            assert csvwise.llm_cache_get_question("other ctx", "平均销售额是多少") is None
+            assert csvwise.llm_cache_get_question("ctx", "最大值是多少") is None
+            csvwise.llm_cache_put_question("ctx", "2023 年总销售额", "100")
+            assert csvwise.llm_cache_get_question("ctx", "2024 年总销售额") is None
+            csvwise.LLM_CACHE_TTL = -1  # everything is now older than the TTL
+            assert csvwise.llm_cache_get_question("ctx", "平均销售额是多少") is None
+            assert csvwise.llm_cache_get("prompt") is None
+        finally:
+            csvwise._llm_cache().close()
+            csvwise._open_llm_cache.cache_clear()
+            csvwise.LLM_CACHE_FILE, csvwise.LLM_CACHE_TTL = old, old_ttl
+
+
+def test_cache_eviction():
+    """Both caches drop their least recently used entries past the size cap."""
+    names = ("LLM_CACHE_FILE", "LLM_CACHE_MAX_BYTES", "ANALYTICS_CACHE_DIR",
+             "ANALYTICS_CACHE_MAX_BYTES")
+    old = {n: getattr(csvwise, n) for n in names}
+    with tempfile.TemporaryDirectory() as d:
+        csvwise.LLM_CACHE_FILE = Path(d) / "llm_cache.db"
+        csvwise.ANALYTICS_CACHE_DIR = Path(d) / "cache"
+        csvwise._open_llm_cache.cache_clear()
+        try:
+            for name in ("a", "b", "c"):
+                csvwise.llm_cache_put(name, "x" * 10)
+            csvwise.llm_cache_put_question("ctx", "q", "y" * 10)
+            conn = csvwise._llm_cache()
+            conn.execute("UPDATE llm_cache SET used = 1 WHERE key = ?", (csvwise._llm_cache_key("a"),))
+            conn.execute("UPDATE llm_questions SET used = 2")
+            conn.commit()
+            conn.close()
+            csvwise._open_llm_cache.cache_clear()
+            csvwise.LLM_CACHE_MAX_BYTES = 25
+            assert csvwise.llm_cache_get("a") is None
+            assert csvwise.llm_cache_get_question("ctx", "q") is None
+            assert csvwise.llm_cache_get("b") == csvwise.llm_cache_get("c") == "x" * 10
+
+            csvwise.ANALYTICS_CACHE_MAX_BYTES = 250
+            csvwise.ANALYTICS_CACHE_DIR.mkdir()
+            now = time.time()
+            for i, age in enumerate((10 * 24 * 3600, 300, 200, 100)):
+                f = csvwise.ANALYTICS_CACHE_DIR / f"{i}.json"
+                f.write_text("{}" + " " * 98)
+                os.utime(f, (now - age, now - age))
+            csvwise.trim_analytics_cache.cache_clear()
+            csvwise.trim_analytics_cache()
+            assert sorted(p.name for p in csvwise.ANALYTICS_CACHE_DIR.iterdir()) == ["2.json", "3.json"]
+        finally:
+            csvwise._llm_cache().close()
+            csvwise._open_llm_cache.cache_clear()
+            csvwise.trim_analytics_cache.cache_clear()
+            for n, v in old.items():
+                setattr(csvwise, n, v)
+
+
+def test_analytics_cache_roundtrip():
+    """A second DataContext on the same unchanged file loads analytics from disk."""
+    old_dir, old_enabled = csvwise.ANALYTICS_CACHE_DIR, csvwise.ANALYTICS_CACHE_ENABLED
+    with tempfile.TemporaryDirectory() as d:
+        csvwise.ANALYTICS_CACHE_DIR = Path(d) / "cache"
+        csvwise.ANALYTICS_CACHE_ENABLED = True
+        try:
+            path = Path(d) / "data.csv"
+            path.write_text("name,value\n" + "".join(f"r{i},{10 + i}\n" for i in range(20)) + "x,9999\n")
+            first = csvwise.DataContext(path)
+            expected = {f: getattr(first, f) for f in csvwise.ANALYTICS_FIELDS}
+            second = csvwise.DataContext(path)
+            assert {f: second.__dict__.get(f) for f in csvwise.ANALYTICS_FIELDS} == expected
+            path.write_text("name,value\na,1\nb,2\n")
+            assert "stats" not in csvwise.DataContext(path).__dict__
+        finally:
+            csvwise.ANALYTICS_CACHE_DIR, csvwise.ANALYTICS_CACHE_ENABLED = old_dir, old_enabled
+
+
+def test_ask_stream_failure_not_cached():
+    """An answer cut off by a failing gemini CLI is reported, never cached."""
+    import argparse
+    import io
+    names = ("LLM_CACHE_FILE", "STATE_DIR", "HISTORY_FILE", "LEGACY_HISTORY_FILE", "_GEMINI_PATH")
+    old = {n: getattr(csvwise, n) for n in names}
+    with tempfile.TemporaryDirectory() as d:
+        stub = Path(d) / "gemini"
+        csv_path = Path(d) / "data.csv"
+        csv_path.write_text("name,score\nA,1\nB,2\n", encoding="utf-8")
+        csvwise.LLM_CACHE_FILE = Path(d) / "llm_cache.db"
+        csvwise.STATE_DIR = Path(d)
+        csvwise.HISTORY_FILE = Path(d) / "history.jsonl"
+        csvwise.LEGACY_HISTORY_FILE = Path(d) / "history.json"
+        csvwise._GEMINI_PATH = str(stub)
+        csvwise._open_llm_cache.cache_clear()
+        args = argparse.Namespace(file=str(csv_path), question=["平均分是多少？"])
+
+        def ask(script):
+            stub.write_text(f"#!{sys.executable}\n{script}\n", encoding="utf-8")
+            stub.chmod(0o755)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                csvwise.cmd_ask(args)
+            return out.getvalue()
+
+        try:
+            out = ask("import sys; print('平均分是'); sys.exit(1)")
+            assert "平均分是" in out and "❌" in out
+            out = ask("print('平均分是 1.5')")
+            assert "平均分是 1.5" in out and "❌" not in out
+            assert "平均分是 1.5" in ask("import sys; sys.exit(1)")  # the good answer is cached
+        finally:
+            csvwise._llm_cache().close()
+            csvwise._open_llm_cache.cache_clear()
+            for n, v in old.items():
+                setattr(csvwise, n, v)
+
+
+def test_history_jsonl_rotation():
+    """History appends one line per entry and rotates down to the newest entries."""
+    names = ("STATE_DIR", "HISTORY_FILE", "LEGACY_HISTORY_FILE",
+             "HISTORY_MAX_ENTRIES", "HISTORY_ROTATE_BYTES", "HISTORY_TAIL_BYTES")
+    old = {n: getattr(csvwise, n) for n in names}
+    with tempfile.TemporaryDirectory() as d:
+        csvwise.STATE_DIR = Path(d)
+        csvwise.HISTORY_FILE = Path(d) / "history.jsonl"
+        csvwise.LEGACY_HISTORY_FILE = Path(d) / "history.json"
+        csvwise.HISTORY_MAX_ENTRIES = 5
+        csvwise.HISTORY_ROTATE_BYTES = 4096
+        try:
+            csvwise.LEGACY_HISTORY_FILE.write_text('[{"action": "ask", "query": "old"}]', encoding="utf-8")
+            csvwise.save_history("ask", "a.csv", "问题", "答案")
+            with open(csvwise.HISTORY_FILE, "a", encoding="utf-8") as f:
+                f.write('{"action": "ask", "qu')  # torn write
+            history = csvwise.load_history()
+            assert [h["query"] for h in history] == ["old", "问题"]
+            assert [h["query"] for h in csvwise.load_history(limit=5)] == ["old", "问题"]
+            for i in range(200):
+                csvwise.save_history("ask", "a.csv", f"q{i}", "x" * 100)
+            history = csvwise.load_history()
+            assert 5 <= len(history) < 30 and history[-1]["query"] == "q199"
+            csvwise.HISTORY_TAIL_BYTES = 300  # a few entries' worth, starting mid-line
+            assert [h["query"] for h in csvwise.load_history(limit=2)] == ["q198", "q199"]
+            assert csvwise.load_history(limit=1000) == history
+            assert not csvwise.LEGACY_HISTORY_FILE.exists()
+        finally:
+            for n, v in old.items():
+                setattr(csvwise, n, v)
+
+
+def test_extract_code():
+    """Code blocks are pulled out of LLM replies, preferring ```python fences."""
+    assert csvwise.extract_code("说明\n```python\nprint(1)\n```\n完") == "print(1)"
+    assert csvwise.extract_code("```\nx = 1\n```\n```python\ny = 2\n```") == "y = 2"
+    assert csvwise.extract_code("```py\nz = 3\n```") == "z = 3"
+    assert csvwise.extract_code("```python\nunclosed()") == "unclosed()"
+    assert csvwise.extract_code("  plain()  ") == "plain()"
+
+
+def test_llm_ask_many_batches():
+    """Several questions go out as one batched prompt; skipped slots are re-asked alone."""
+    calls = []
+
+    def fake_call(prompt, timeout=None, retries=None):
+        calls.append(prompt)
+        if "===Q" in prompt:
+            return "===Q1===\nA1\n===Q3===\nA3"
+        return "single:" + prompt.split("Q: ")[1].split("|")[0]
+
+    old_call, old_enabled = csvwise._llm_call, csvwise.LLM_CACHE_ENABLED
+    csvwise._llm_call, csvwise.LLM_CACHE_ENABLED = fake_call, False
+    try:
+        answers = csvwise.llm_ask_many("Q: ", "|end", ["a", "b", "c"])
+    finally:
+        csvwise._llm_call, csvwise.LLM_CACHE_ENABLED = old_call, old_enabled
+    assert answers == ["A1", "single:b", "A3"]
+    assert len(calls) == 2 and "1) a" in calls[0] and calls[0].endswith("|end")
+
+
+def test_summarize_numeric_numpy_path():
+    """NumPy fast path (when installed) must match the stdlib path."""
+    if csvwise._numpy() is None:
+        return
+    values = [float((i * 7919) % 1000) for i in range(1001)]
+    old = csvwise.NUMPY_MIN_VALUES
+    try:
+        csvwise.NUMPY_MIN_VALUES = 10 ** 9
+        expected = csvwise.summarize_numeric(values)
+        csvwise.NUMPY_MIN_VALUES = 0
+        assert csvwise.summarize_numeric(values) == expected
+    finally:
+        csvwise.NUMPY_MIN_VALUES = old
+
+
+def test_parse_numeric_columns_shared():
+    """Pre-parsed columns (array-backed or not) give the same stats and outliers."""
+    headers = ["id", "value"]
+    data = [[str(i), str(10 + i)] for i in range(20)] + [["20", "$9,999"]]
+    types = csvwise.infer_column_types(headers, data)
+    expected = csvwise.detect_outliers(headers, data, types)
+    old, old_workers = csvwise.NUMPY_MIN_VALUES, csvwise.STATS_MAX_WORKERS
+    try:
+        csvwise.NUMPY_MIN_VALUES = 0
+        columns = csvwise.parse_numeric_columns(headers, data, types)
+        assert columns["value"][1][-1] == 20
+        stats = csvwise.compute_basic_stats(headers, data, types, columns)
+        assert csvwise.detect_outliers(headers, data, types, stats, columns) == expected
+        # Columns fanned out over threads give the same result, in column order
+        csvwise.STATS_MAX_WORKERS = 4
+        assert csvwise.compute_basic_stats(headers, data, types, columns) == stats
+        assert list(csvwise.compute_basic_stats(headers, data, types, columns)) == ["id", "value"]
+        assert csvwise.detect_outliers(headers, data, types, stats, columns) == expected
+    finally:
+        csvwise.NUMPY_MIN_VALUES, csvwise.STATS_MAX_WORKERS = old, old_workers
+    assert expected["value"]["rows"] == [22]
+
+
+def test_numeric_column_aligned():
+    """numeric_column keeps row positions; empty and non-numeric cells are NaN."""
+    ctx = csvwise.DataContext(
+        headers=["name", "amount"],
+        rows=[["a", "1"], ["b", ""], ["c", "$1,200"], ["d", None], ["e", "x"]] + [["f", "2"]] * 5,
+    )
+    values = list(ctx.numeric_column("amount"))
+    assert values[0] == 1.0 and values[2] == 1200.0 and values[-1] == 2.0
+    assert all(v != v for v in (values[1], values[3], values[4]))
+    assert len(values) == len(ctx.data)
+
+
+def test_transpose_columns():
+    """Column view strips cells and pads short rows."""
+    columns = csvwise.transpose_columns(["a", "b", "c"], [[" 1 ", "x"], ["2", " ", "y", "extra"]])
+    assert columns == [["1", "2"], ["x", ""], ["", "y"]]
+
+
+def test_infer_pattern_types():
+    """Pattern columns are detected by the combined regex, in PATTERNS order."""
+    headers = ["mail", "site", "flag", "ip", "text"]
+    data = [[f"u{i}@example.com", f"https://x.io/{i}", "Yes", f"10.0.0.{i}", "hello"] for i in range(10)]
+    types = csvwise.infer_column_types(headers, data)
+    assert types == {"mail": "email", "site": "url", "flag": "boolean", "ip": "ip_address", "text": "text"}
+
+
+def test_find_cached_question():
+    """Only the same normalized question reuses an answer, never a look-alike."""
+    answers = {csvwise.normalize_question("哪个地区 2023 年销售额最高？"): "华东"}
+    assert csvwise.find_cached_question("哪个地区2023年销售额最高", answers) is not None
+    assert csvwise.find_cached_question("哪个地区 2024 年销售额最高？", answers) is None
+    answers = {csvwise.normalize_question("Sort by price ascending"): "..."}
+    assert csvwise.find_cached_question("sort by price, ascending!", answers) is not None
+    assert csvwise.find_cached_question("sort by price descending", answers) is None
+
+
+def test_split_batch_answers():
+    """Batched response is split per ===Q{i}=== marker; skipped questions are None."""
+    prompt = csvwise.build_batch_question(["a?", "b?", "c?"])
+    assert "1) a?" in prompt and "3) c?" in prompt
+    text = "好的\n===Q1===\n答案一\n第二行\n=== Q3 ===\n答案三\n===Q9===\n多余"
+    answers = csvwise.split_batch_answers(text, 3)
+    assert answers == ["答案一\n第二行", None, "答案三"]
+    assert csvwise.split_batch_answers("没有分隔符", 2) == [None, None]
+
+
+# ---------------------------------------------------------------------------
+# Database connector (SQLite)
+# ---------------------------------------------------------------------------
+
+class _TrackingConnector(db_connector.DatabaseConnector):
+    """Counts cursors currently borrowed through _cursor()."""
+    open_cursors = 0
+
+    @contextlib.contextmanager
+    def _cursor(self, name=None):
+        self.open_cursors += 1
+        try:
+            with super()._cursor(name) as cursor:
+                yield cursor
+        finally:
+            self.open_cursors -= 1
+
+
+def _sqlite_db(d, table, n_rows):
+    path = os.path.join(d, "test.db")
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE {db_connector.quote_identifier(table)} (id INTEGER, name TEXT)")
+    conn.executemany(f"INSERT INTO {db_connector.quote_identifier(table)} VALUES (?, ?)",
+                     [(i, f"n{i}") for i in range(n_rows)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_quote_identifier():
+    """Identifiers with embedded quotes are escaped, not spliced into the SQL."""
+    assert db_connector.quote_identifier("orders") == '"orders"'
+    assert db_connector.quote_identifier('we"ird') == '"we""ird"'
+    table = 'sales "2024"; DROP TABLE x'
+    with tempfile.TemporaryDirectory() as d:
+        with db_connector.DatabaseConnector(_sqlite_db(d, table, 3)) as db:
+            assert db.list_tables() == [table]
+            assert [c["name"] for c in db.get_table_schema(table)] == ["id", "name"]
+            headers, rows = db.query_table(table, limit=2, columns=["name"])
+            assert headers == ["name"] and rows == [("n0",), ("n1",)]
+            assert db.get_table_row_count(table) == 3
+
+
+def test_iter_table_rows():
+    """Rows stream in chunks; the cursor goes back once exhausted or closed early."""
+    with tempfile.TemporaryDirectory() as d:
+        with _TrackingConnector(_sqlite_db(d, "t", 25)) as db:
+            headers, rows = db.iter_table_rows("t", limit=20, chunk_size=7)
+            assert headers == ["id", "name"] and db.open_cursors == 1
+            assert [r[0] for r in rows] == list(range(20))
+            assert db.open_cursors == 0
+
+            _, rows = db.iter_table_rows("t", chunk_size=7)
+            assert next(rows) == (0, "n0") and db.open_cursors == 1
+            rows.close()
+            assert db.open_cursors == 0
+            assert "id,name\r\n0,n0\r\n" in db.table_to_csv_string("t", limit=2)
+            assert db.open_cursors == 0
+
+            # The public .conn attribute is still the live DB-API connection
+            assert db.conn.execute("SELECT COUNT(*) FROM t").fetchone() == (25,)
+        assert db.conn is None
+
+
+def test_table_row_count_estimate():
+    """SQLite estimates reuse a slow exact count; exact counts always re-run."""
+    old = db_connector.SLOW_COUNT_SECONDS
+    with tempfile.TemporaryDirectory() as d:
+        path = _sqlite_db(d, "t", 5)
+        try:
+            with db_connector.DatabaseConnector(path) as db:
+                assert db.get_table_row_count("t", estimate=True) == 5  # fast: not kept
+                db.conn.execute("INSERT INTO t VALUES (5, 'n5')")
+                assert db.get_table_row_count("t", estimate=True) == 6
+                db_connector.SLOW_COUNT_SECONDS = -1  # every count now counts as slow
+                assert db.get_table_row_count("t") == 6
+                db.conn.execute("INSERT INTO t VALUES (6, 'n6')")
+                assert db.get_table_row_count("t", estimate=True) == 6
+                assert db.get_table_row_count("t") == 7
+        finally:
+            db_connector.SLOW_COUNT_SECONDS = old
 
 
 # ---------------------------------------------------------------------------
@@ -302,6 +788,31 @@ if __name__ == "__main__":
         test_load_csv_empty_rows,
         test_truncate_edge_cases,
         test_csv_to_markdown_table_padded,
+        test_load_csv_from_bytes,
+        test_load_csv_shares_repeated_cells,
+        test_detect_delimiter,
+        test_load_csv_encoding_past_sample,
+        test_data_context_from_rows,
+        test_data_context_scan_rows,
+        test_data_context_max_rows,
+        test_smart_sample,
+        test_llm_cache_roundtrip,
+        test_cache_eviction,
+        test_analytics_cache_roundtrip,
+        test_ask_stream_failure_not_cached,
+        test_history_jsonl_rotation,
+        test_extract_code,
+        test_llm_ask_many_batches,
+        test_summarize_numeric_numpy_path,
+        test_parse_numeric_columns_shared,
+        test_numeric_column_aligned,
+        test_transpose_columns,
+        test_infer_pattern_types,
+        test_split_batch_answers,
+        test_find_cached_question,
+        test_quote_identifier,
+        test_iter_table_rows,
+        test_table_row_count_estimate,
     ]
     passed = 0
     failed = 0